@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from api import metrics
+from api.caches import is_shared
+
+# В кеш попадают только поля, которые читают проверка токена, права
+# доступа и сериализаторы; хеш пароля и остальное подгружаются по запросу.
+TOKEN_FIELDS = ('key', 'user_id', 'created')
+USER_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser'
+)
+local_tokens = OrderedDict()
+local_lock = threading.Lock()
+
+
+def token_cache_key(key):
+    return 'auth:token:' + sha256(key.encode()).hexdigest()
+
+
+def get_local(key):
+    with local_lock:
+        entry = local_tokens.get(key)
+        if entry is None:
+            return None
+        if entry[1] < monotonic():
+            del local_tokens[key]
+            return None
+        local_tokens.move_to_end(key)
+        return entry[0]
+
+
+def set_local(key, data):
+    with local_lock:
+        local_tokens[key] = (data, monotonic() + settings.AUTH_TOKEN_LOCAL_TTL)
+        local_tokens.move_to_end(key)
+        while len(local_tokens) > settings.AUTH_TOKEN_CACHE_SIZE:
+            local_tokens.popitem(last=False)
+
+
+def forget(keys):
+    keys = list(keys)
+
+    def delete():
+        with local_lock:
+            for key in keys:
+                local_tokens.pop(key, None)
+        cache.delete_many([token_cache_key(key) for key in keys])
+
+    if keys:
+        transaction.on_commit(delete)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def get_user_fields(self):
+        # Model.from_db ждёт значения в порядке полей модели.
+        user_model = self.get_model()._meta.get_field('user').related_model
+        return user_model, [
+            field.attname for field in user_model._meta.concrete_fields
+            if field.attname in USER_FIELDS
+        ]
+
+    def build_token(self, data):
+        token_values, user_values = data
+        model = self.get_model()
+        user_model, user_fields = self.get_user_fields()
+        token = model.from_db(model.objects.db, TOKEN_FIELDS, token_values)
+        token.user = user_model.from_db(
+            user_model.objects.db, user_fields, user_values
+        )
+        return token
+
+    def load_token(self, key):
+        data = get_local(key)
+        if data is not None:
+            metrics.inc(
+                'foodgram_cache_requests_total', cache='auth_local',
+                result='hit'
+            )
+            return self.build_token(data)
+        data = cache.get(token_cache_key(key))
+        metrics.inc(
+            'foodgram_cache_requests_total', cache='auth',
+            result='miss' if data is None else 'hit'
+        )
+        if data is None:
+            _, user_fields = self.get_user_fields()
+            row = self.get_model().objects.filter(key=key).values_list(
+                *TOKEN_FIELDS, *(f'user__{name}' for name in user_fields)
+            ).first()
+            if row is None:
+                return None
+            data = (row[:len(TOKEN_FIELDS)], row[len(TOKEN_FIELDS):])
+            cache.set(
+                token_cache_key(key), data, settings.AUTH_TOKEN_CACHE_TIMEOUT
+            )
+        set_local(key, data)
+        return self.build_token(data)
+
+    def authenticate_credentials(self, key):
+        if not is_shared():
+            return super().authenticate_credentials(key)
+        token = self.load_token(key)
+        if token is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
@@ -0,0 +1,29 @@
+from random import randrange
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared():
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def shared_timeout(timeout):
+    if is_shared():
+        return timeout
+    if timeout is None:
+        return settings.LOCAL_CACHE_TIMEOUT
+    return min(timeout, settings.LOCAL_CACHE_TIMEOUT)
+
+
+def get_generations(keys, timeout):
+    generations = cache.get_many(keys)
+    missing = {
+        key: randrange(2 ** 48) for key in keys if key not in generations
+    }
+    if missing:
+        cache.set_many(missing, timeout)
+        generations.update(missing)
+    return generations
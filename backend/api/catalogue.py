@@ -0,0 +1,143 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from api import metrics
+from api.caches import shared_timeout
+from api.models import Catalogue, CatalogueChange
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(max_workers=1)
+local_cache = {}
+local_objects = {}
+scheduled = set()
+scheduled_lock = Lock()
+
+
+def version_key(name):
+    return f'catalogue:{name}:version'
+
+
+def get_version(name):
+    version = cache.get(version_key(name))
+    if version is None:
+        version = Catalogue.objects.filter(name=name).values_list(
+            'version', flat=True
+        ).first() or 0
+        cache.set(
+            version_key(name), version,
+            shared_timeout(settings.CATALOGUE_VERSION_TIMEOUT)
+        )
+    return version
+
+
+@transaction.atomic
+def bump(name, changed=None):
+    if changed is not None:
+        changed = set(changed)
+        if not changed:
+            return
+        if len(changed) > settings.CATALOGUE_MAX_CHANGES:
+            changed = None
+    # Строка каталога заблокирована до конца транзакции, поэтому версии
+    # фиксируются строго по порядку и читатель не пропустит изменение.
+    catalogue, _ = Catalogue.objects.select_for_update().get_or_create(
+        name=name
+    )
+    catalogue.version += 1
+    catalogue.save(update_fields=('version',))
+    CatalogueChange.objects.bulk_create(
+        CatalogueChange(
+            catalogue=catalogue, version=catalogue.version, object_id=pk
+        )
+        for pk in (changed or (None,))
+    )
+    CatalogueChange.objects.filter(
+        catalogue=catalogue,
+        version__lte=catalogue.version - settings.CATALOGUE_MAX_CHANGES
+    ).delete()
+    transaction.on_commit(lambda: cache.delete(version_key(name)))
+
+
+def invalidate(name, changed=None):
+    transaction.on_commit(lambda: bump(name, changed))
+
+
+def get_changes(name, since, version):
+    if not 0 <= version - since <= settings.CATALOGUE_MAX_CHANGES:
+        return None
+    versions, changed = set(), set()
+    for number, pk in CatalogueChange.objects.filter(
+        catalogue=name, version__gt=since, version__lte=version
+    ).values_list('version', 'object_id'):
+        if pk is None:
+            return None
+        versions.add(number)
+        changed.add(pk)
+    if len(versions) != version - since:
+        return None
+    return changed
+
+
+def get_body(name, version, build):
+    cached = local_cache.get(name)
+    if cached is not None and cached[0] == version:
+        metrics.inc(
+            'foodgram_cache_requests_total', cache='catalogue', result='hit'
+        )
+        return cached[1]
+
+    body_key = f'catalogue:{name}:{version}'
+    body = cache.get(body_key)
+    metrics.inc(
+        'foodgram_cache_requests_total',
+        cache='catalogue', result='miss' if body is None else 'hit'
+    )
+    if body is None:
+        body = build()
+        cache.set(body_key, body, settings.CATALOGUE_CACHE_TIMEOUT)
+    local_cache[name] = (version, body)
+    return body
+
+
+def refresh_local(key, version, build, update):
+    cached = local_objects.get(key)
+    changed = None
+    if cached is not None and update is not None:
+        changed = get_changes(key[0], cached[0], version)
+    if changed is None:
+        cached = (version, build())
+    else:
+        cached = (version, update(cached[1], changed))
+    local_objects[key] = cached
+    return cached[1]
+
+
+def run_refresh(key, version, build, update):
+    try:
+        refresh_local(key, version, build, update)
+    except Exception:
+        logger.exception('Не удалось обновить %s', '/'.join(key))
+    finally:
+        with scheduled_lock:
+            scheduled.discard(key)
+        connection.close()
+
+
+def get_local(name, kind, build, update=None, background=False):
+    key = (name, kind)
+    version = get_version(name)
+    cached = local_objects.get(key)
+    if cached is not None and cached[0] >= version:
+        return cached[1]
+    if not background:
+        return refresh_local(key, version, build, update)
+    with scheduled_lock:
+        if key not in scheduled:
+            scheduled.add(key)
+            executor.submit(run_refresh, key, version, build, update)
+    return None if cached is None else cached[1]
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api import metrics
+from api.caches import get_generations, shared_timeout
+from recipes.models import Recipe
+
+FIELDS = ('favorites_count', 'carts_count')
+
+
+def generation_key(recipe_id):
+    return f'counters:{recipe_id}:generation'
+
+
+def counters_key(recipe_id, generation):
+    return f'counters:{recipe_id}:{generation}'
+
+
+def get_counters(recipe_ids):
+    timeout = shared_timeout(settings.RESPONSE_CACHE_TIMEOUT)
+    generations = get_generations(
+        [generation_key(recipe_id) for recipe_id in recipe_ids], timeout
+    )
+    keys = {
+        counters_key(recipe_id, generations[generation_key(recipe_id)]):
+            recipe_id
+        for recipe_id in recipe_ids
+    }
+    found = cache.get_many(keys)
+    counters = {keys[key]: value for key, value in found.items()}
+    missing = set(keys.values()) - counters.keys()
+    metrics.inc(
+        'foodgram_cache_requests_total', len(found),
+        cache='counters', result='hit'
+    )
+    if missing:
+        metrics.inc(
+            'foodgram_cache_requests_total', len(missing),
+            cache='counters', result='miss'
+        )
+        loaded = {
+            recipe_id: tuple(values)
+            for recipe_id, *values in Recipe.objects.filter(
+                pk__in=missing
+            ).order_by().values_list('id', *FIELDS)
+        }
+        cache.set_many({
+            counters_key(recipe_id, generations[generation_key(recipe_id)]):
+                value
+            for recipe_id, value in loaded.items()
+        }, timeout)
+        counters.update(loaded)
+    return counters
+
+
+def invalidate(recipe_ids):
+    keys = [generation_key(recipe_id) for recipe_id in recipe_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
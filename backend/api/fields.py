@@ -0,0 +1,44 @@
+from django.conf import settings
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.serializers import Field, ValidationError
+
+from recipes.images import ImageTooLarge, open_image, rendition_urls
+
+
+class CompressedImageField(Base64ImageField):
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            payload = data.rpartition(';base64,')[2]
+            if len(payload) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+                raise ValidationError(
+                    'Размер изображения больше '
+                    f'{settings.RECIPE_IMAGE_MAX_SIZE} байт'
+                )
+        image = super().to_internal_value(data)
+        if image is None:
+            return None
+        # Сжатие и миниатюры делаются в фоне после сохранения рецепта.
+        try:
+            open_image(image)
+        except ImageTooLarge as error:
+            raise ValidationError(
+                f'Слишком большое разрешение изображения {error}'
+            )
+        return image
+
+
+class RenditionsField(Field):
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        urls = rendition_urls(recipe)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {
+            rendition: request.build_absolute_uri(url)
+            for rendition, url in urls.items()
+        }
@@ -1,23 +1,102 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import Case, FloatField, IntegerField, Value, When
+from django.db.models.functions import Lower, Replace
 from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe
+from api import catalogue
+from api.search import get_ingredient_index, get_recipe_index, normalize
+from recipes.models import Recipe, Tag
 
 User = get_user_model()
 
 
 class IngredientSearchFilter(SearchFilter):
     search_param = 'name'
+    limit_param = 'limit'
+
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_param, '')
+        return int(limit) if limit.isdigit() else None
+
+    def filter_queryset(self, request, queryset, view):
+        query = normalize(request.query_params.get(self.search_param, ''))
+        if not query:
+            return queryset
+        limit = self.get_limit(request)
+        if settings.INGREDIENT_SEARCH_INDEX:
+            return get_ingredient_index().search(query, limit)
+        return queryset.annotate(
+            search_name=Replace(Lower('name'), Value('ё'), Value('е'))
+        ).filter(search_name__contains=query).annotate(
+            rank=Case(
+                When(search_name__startswith=query, then=0),
+                default=1,
+                output_field=IntegerField()
+            )
+        ).order_by('rank', 'name')[:limit]
+
+
+class RecipeSearchFilter(SearchFilter):
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        if connections[queryset.db].vendor == 'postgresql':
+            return queryset.search(term)
+
+        scores = get_recipe_index().search(term)
+        if not scores:
+            return queryset.none()
+        return queryset.filter(pk__in=scores).annotate(rank=Case(
+            *(When(pk=pk, then=Value(score))
+              for pk, score in scores.items()),
+            output_field=FloatField()
+        )).order_by('-rank', '-pub_date', '-id')
+
+
+def get_tag_ids():
+    def build():
+        tag_ids = {}
+        for pk, slug in Tag.objects.values_list('id', 'slug'):
+            tag_ids.setdefault(slug, []).append(pk)
+        return tag_ids
+    return catalogue.get_local('tags', 'slugs', build)
 
 
 class RecipeFilter(FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.CharFilter(method='filter_tags')
+    tags_match = filters.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')), method='filter_tags_match'
+    )
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids()
+        slugs = set(self.request.query_params.getlist(name))
+        groups = [tag_ids.get(slug, ()) for slug in slugs]
+        if self.form.cleaned_data.get('tags_match') != 'all':
+            groups = [[pk for group in groups for pk in group]]
+        for group in groups:
+            if not group:
+                return queryset.none()
+            queryset = queryset.filter(
+                pk__in=Recipe.tags.through.objects.filter(
+                    tag__in=group
+                ).values('recipe')
+            )
+        return queryset
+
+    def filter_tags_match(self, queryset, name, value):
+        return queryset
+
     def filter_is_favorited(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
             return queryset.filter(favorite=self.request.user.id)
@@ -0,0 +1,106 @@
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from random import random
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+state = threading.local()
+IN_LIST_RE = re.compile(r'IN \(%s(?:, %s)*\)')
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * rank // 100)]
+
+
+def fingerprint(sql):
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.serialize = 0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return sum(
+            count - 1 for count in self.fingerprints.values() if count > 1
+        )
+
+
+class InstrumentedSerializerMixin:
+    def to_representation(self, instance):
+        recorder = getattr(state, 'recorder', None)
+        if recorder is None or state.depth:
+            return super().to_representation(instance)
+        state.depth += 1
+        start = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            recorder.serialize += perf_counter() - start
+            state.depth -= 1
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random() >= settings.INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = state.recorder = QueryRecorder()
+        state.depth = 0
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            state.recorder = None
+        total = perf_counter() - start
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries", '
+            f'serialize;dur={recorder.serialize * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+        self.log(request, response, recorder, total)
+        return response
+
+    def log(self, request, response, recorder, total):
+        match = request.resolver_match
+        record = {
+            'route': match.view_name if match else None,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(recorder.duration * 1000, 2),
+            'serialize_ms': round(recorder.serialize * 1000, 2),
+            'queries': recorder.count,
+            'duplicates': recorder.duplicates(),
+        }
+        if record['duplicates']:
+            sql, count = recorder.fingerprints.most_common(1)[0]
+            record['top_duplicate'] = {'sql': sql[:300], 'count': count}
+        logger.info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,469 @@
+import base64
+import json
+import tracemalloc
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+from itertools import count
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.http import urlencode
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+
+from api.instrumentation import percentile
+from api.urls import router
+from recipes.management.commands.seed_benchmark_data import PASSWORD, PREFIX
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+TOKEN_ROUTES = {'login', 'logout'}
+SKIPPED_ROUTES = {
+    'users-activation', 'users-resend-activation', 'users-reset-password',
+    'users-reset-password-confirm', 'users-reset-username',
+    'users-reset-username-confirm', 'users-set-username',
+}
+PERCENTILES = (50, 90, 99)
+RECIPE_SIZES = (5, 50, 200)
+VALIDATION_SIZES = (100, 500)
+FEED_SIZES = (10, 100, 1000)
+
+Scenario = namedtuple(
+    'Scenario',
+    'name route client method path data before after status settings'
+)
+
+
+def scenario(name, route, client, path, method='get', data=None,
+             before=None, after=None, status=None, settings=None):
+    return Scenario(
+        name, route, client, method, path, data, before, after, status,
+        settings or {}
+    )
+
+
+def image_payload():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (120, 180, 90)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def authorize(client, user):
+    token, _ = Token.objects.get_or_create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+class Command(BaseCommand):
+    help = 'Замер времени ответа, числа запросов и памяти для маршрутов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Число замеров на сценарий'
+        )
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--only', action='append', default=[],
+            help='Запустить только сценарии с этим префиксом имени'
+        )
+        parser.add_argument(
+            '--clear-cache', action='store_true',
+            help='Очистить кеш перед замерами'
+        )
+        parser.add_argument('--save', help='Сохранить результат в JSON')
+        parser.add_argument('--baseline', help='Сравнить с JSON-результатом')
+        parser.add_argument(
+            '--tolerance', type=float, default=20,
+            help='Допустимый рост p99 в процентах'
+        )
+
+    def recipe_data(self, ingredients=None):
+        return {
+            'name': f'Бенчмарк {next(self.names)}',
+            'text': 'Рецепт для замера',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': self.tags,
+            'ingredients': ingredients or self.ingredients,
+        }
+
+    def sized_ingredients(self, size):
+        amount = next(self.names) % 100 + 1
+        return [
+            {'id': pk, 'amount': amount if number == 0 else 10}
+            for number, pk in enumerate(self.catalogue[:size])
+        ]
+
+    def create_recipe(self, ingredients=None):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(ingredients), format='json'
+        )
+        self.created.append(response.data['id'])
+        return response.data['id']
+
+    def prepare(self):
+        users = list(User.objects.filter(
+            username__startswith=PREFIX
+        ).order_by('pk')[:2 + len(FEED_SIZES)])
+        if len(users) < 2 + len(FEED_SIZES):
+            raise CommandError('Сначала выполните seed_benchmark_data')
+        self.user, self.other, *self.followers = users
+        self.anonymous, self.client, self.other_client = (
+            APIClient(), APIClient(), APIClient()
+        )
+        authorize(self.client, self.user)
+        self.recipe = Recipe.objects.exclude(favorite=self.user).exclude(
+            cart=self.user
+        ).filter(ingredient__isnull=False).order_by('-pub_date').first()
+        self.author = User.objects.exclude(pk=self.user.pk).exclude(
+            subscribers=self.user
+        ).filter(recipes__isnull=False).first()
+        self.ingredient = Ingredient.objects.first()
+        size = max(RECIPE_SIZES + VALIDATION_SIZES)
+        self.catalogue = list(Ingredient.objects.order_by('pk').values_list(
+            'id', flat=True
+        )[:size])
+        if len(self.catalogue) < size:
+            raise CommandError(f'Нужно не менее {size} ингредиентов')
+        self.tag = Tag.objects.first()
+        self.names = count()
+        self.image = image_payload()
+        self.tags = [self.tag.id]
+        self.ingredients = [
+            {'id': link.ingredients_id, 'amount': link.amount}
+            for link in self.recipe.ingredient.all()
+        ]
+        self.created = []
+        self.scratch = self.create_recipe()
+        self.sized = {
+            size: self.create_recipe(self.sized_ingredients(size))
+            for size in RECIPE_SIZES
+        }
+
+    def user_scenarios(self):
+        client, anonymous, author = self.client, self.anonymous, self.author
+        return (
+            scenario('api-root', 'api-root', anonymous, '/api/'),
+            scenario('users-list', 'users-list', client, '/api/users/'),
+            scenario(
+                'users-create', 'users-list', anonymous, '/api/users/',
+                method='post',
+                data=lambda: {
+                    'email': f'{PREFIX}new{next(self.names)}@example.com',
+                    'username': f'{PREFIX}new{next(self.names)}',
+                    'first_name': 'Тест', 'last_name': 'Тест',
+                    'password': PASSWORD,
+                },
+                after=lambda r: User.objects.filter(pk=r.data['id']).delete()
+            ),
+            scenario('users-detail', 'users-detail', client,
+                     f'/api/users/{author.pk}/'),
+            scenario('users-me', 'users-me', client, '/api/users/me/'),
+            scenario(
+                'users-set-password', 'users-set-password', client,
+                '/api/users/set_password/', method='post',
+                data={'current_password': PASSWORD, 'new_password': PASSWORD}
+            ),
+            scenario('users-subscriptions', 'users-subscriptions', client,
+                     '/api/users/subscriptions/?recipes_limit=3'),
+            scenario(
+                'users-subscribe', 'users-subscribe', client,
+                f'/api/users/{author.pk}/subscribe/', method='post',
+                after=lambda r: self.user.subscribe.remove(author)
+            ),
+            scenario(
+                'token-login', 'login', anonymous, '/api/auth/token/login/',
+                method='post',
+                data={'email': self.other.email, 'password': PASSWORD}
+            ),
+            scenario(
+                'token-logout', 'logout', self.other_client,
+                '/api/auth/token/logout/', method='post',
+                before=lambda: authorize(self.other_client, self.other)
+            ),
+        )
+
+    def search_scenarios(self):
+        name = self.ingredient.name
+        scenarios = ()
+        for suffix, index in (('', True), ('-db', False)):
+            for kind, query in (('prefix', name[:3]),
+                                ('substring', name[1:4])):
+                scenarios += (scenario(
+                    f'ingredients-search-{kind}{suffix}', 'ingredients-list',
+                    self.anonymous, '/api/ingredients/?' + urlencode(
+                        {'name': query, 'limit': 20}
+                    ),
+                    settings={'INGREDIENT_SEARCH_INDEX': index}
+                ),)
+        return scenarios
+
+    def catalogue_scenarios(self):
+        anonymous, ingredient, tag = self.anonymous, self.ingredient, self.tag
+        return self.search_scenarios() + (
+            scenario('ingredients-list', 'ingredients-list', anonymous,
+                     '/api/ingredients/'),
+            scenario('ingredients-detail', 'ingredients-detail', anonymous,
+                     f'/api/ingredients/{ingredient.pk}/'),
+            scenario('tags-list', 'tags-list', anonymous, '/api/tags/'),
+            scenario('tags-detail', 'tags-detail', anonymous,
+                     f'/api/tags/{tag.pk}/'),
+        )
+
+    def recipe_scenarios(self):
+        client, anonymous, recipe = self.client, self.anonymous, self.recipe
+        return (
+            scenario('recipes-list-anonymous', 'recipes-list', anonymous,
+                     '/api/recipes/'),
+            scenario('recipes-list', 'recipes-list', client, '/api/recipes/'),
+            scenario('recipes-list-filtered', 'recipes-list', client,
+                     '/api/recipes/?' + urlencode(
+                         {'tags': self.tag.slug, 'is_favorited': 1}
+                     )),
+            scenario('recipes-list-search', 'recipes-list', anonymous,
+                     '/api/recipes/?' + urlencode(
+                         {'search': recipe.name.split()[0]}
+                     )),
+            scenario('recipes-list-cursor', 'recipes-list', anonymous,
+                     '/api/recipes/?pagination=cursor'),
+            scenario('recipes-detail-anonymous', 'recipes-detail', anonymous,
+                     f'/api/recipes/{recipe.pk}/'),
+            scenario('recipes-detail', 'recipes-detail', client,
+                     f'/api/recipes/{recipe.pk}/'),
+            scenario(
+                'recipes-create', 'recipes-list', client, '/api/recipes/',
+                method='post', data=self.recipe_data,
+                after=lambda r: Recipe.objects.filter(
+                    pk=r.data['id']
+                ).delete()
+            ),
+            scenario('recipes-update', 'recipes-detail', client,
+                     f'/api/recipes/{self.scratch}/', method='patch',
+                     data=self.recipe_data),
+            scenario(
+                'recipes-delete', 'recipes-detail', client,
+                lambda: f'/api/recipes/{self.create_recipe()}/',
+                method='delete'
+            ),
+            scenario('recipes-feed', 'recipes-feed', client,
+                     '/api/recipes/feed/'),
+            scenario('recipes-cook', 'recipes-cook', anonymous,
+                     '/api/recipes/cook/?' + urlencode({'ingredients': [
+                         item['id'] for item in self.ingredients[::2]
+                     ]}, doseq=True)),
+            scenario(
+                'recipes-favorite', 'recipes-favorite', client,
+                f'/api/recipes/{recipe.pk}/favorite/', method='post',
+                after=lambda r: self.user.favorites.remove(recipe)
+            ),
+            scenario(
+                'recipes-shopping-cart', 'recipes-shopping-cart', client,
+                f'/api/recipes/{recipe.pk}/shopping_cart/', method='post',
+                after=lambda r: self.user.carts.remove(recipe)
+            ),
+            scenario('recipes-download-shopping-cart',
+                     'recipes-download-shopping-cart', client,
+                     '/api/recipes/download_shopping_cart/'),
+        )
+
+    def write_scenarios(self):
+        scenarios = ()
+        for size in RECIPE_SIZES:
+            scenarios += (
+                scenario(
+                    f'recipes-create-{size}', 'recipes-list', self.client,
+                    '/api/recipes/', method='post',
+                    data=lambda size=size: self.recipe_data(
+                        self.sized_ingredients(size)
+                    ),
+                    after=lambda r: Recipe.objects.filter(
+                        pk=r.data['id']
+                    ).delete()
+                ),
+                scenario(
+                    f'recipes-update-{size}', 'recipes-detail', self.client,
+                    f'/api/recipes/{self.sized[size]}/', method='patch',
+                    data=lambda size=size: self.recipe_data(
+                        self.sized_ingredients(size)
+                    )
+                ),
+            )
+        for size in VALIDATION_SIZES:
+            scenarios += (scenario(
+                f'recipes-validate-{size}', 'recipes-list', self.client,
+                '/api/recipes/', method='post',
+                data=lambda size=size: self.recipe_data(
+                    self.sized_ingredients(size)
+                    + self.sized_ingredients(1)
+                ),
+                status=400
+            ),)
+        return scenarios
+
+    def feed_scenarios(self):
+        authors = list(User.objects.filter(
+            username__startswith=PREFIX, recipes__isnull=False
+        ).distinct().order_by('pk').values_list(
+            'pk', flat=True
+        )[:max(FEED_SIZES)])
+        scenarios = ()
+        for follower in self.followers:
+            size = min(FEED_SIZES[len(scenarios)], len(authors))
+            follower.subscribe.set(authors[:size])
+            client = APIClient()
+            authorize(client, follower)
+            scenarios += (scenario(
+                f'recipes-feed-{size}', 'recipes-feed', client,
+                '/api/recipes/feed/'
+            ),)
+        return scenarios
+
+    def deep_cursor(self, offset):
+        recipe = Recipe.objects.order_by('-pub_date', '-id')[offset]
+        return base64.b64encode(
+            urlencode({'p': str(recipe.pub_date)}).encode()
+        ).decode()
+
+    def pagination_scenarios(self):
+        page_size = api_settings.PAGE_SIZE
+        deep = max(Recipe.objects.count() // page_size, 1)
+        paths = (
+            ('page-first', {'page': 1}),
+            ('page-deep', {'page': deep}),
+            ('cursor-first', {'pagination': 'cursor'}),
+            ('cursor-deep', {
+                'cursor': self.deep_cursor((deep - 1) * page_size - 1)
+            } if deep > 1 else {'pagination': 'cursor'}),
+        )
+        return tuple(
+            scenario(
+                f'recipes-list-{name}', 'recipes-list', self.client,
+                '/api/recipes/?' + urlencode(params),
+                settings={'RESPONSE_CACHE_TIMEOUT': 0}
+            )
+            for name, params in paths
+        )
+
+    def get_scenarios(self):
+        scenarios = (self.user_scenarios() + self.catalogue_scenarios()
+                     + self.recipe_scenarios() + self.write_scenarios()
+                     + self.pagination_scenarios() + self.feed_scenarios())
+        routes = {url.name for url in router.urls} | TOKEN_ROUTES
+        missing = routes - SKIPPED_ROUTES - {item.route for item in scenarios}
+        if missing:
+            self.stderr.write(
+                f'Маршруты без сценариев: {", ".join(sorted(missing))}'
+            )
+        return scenarios
+
+    def request(self, scenario, probe=False):
+        path = scenario.path() if callable(scenario.path) else scenario.path
+        data = scenario.data() if callable(scenario.data) else scenario.data
+        if scenario.before:
+            scenario.before()
+        send = getattr(scenario.client, scenario.method)
+        with override_settings(**scenario.settings), \
+                CaptureQueriesContext(connection) as queries:
+            if probe:
+                tracemalloc.start()
+            start = perf_counter()
+            response = send(path) if scenario.method == 'get' else send(
+                path, data, format='json'
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = perf_counter() - start
+            memory = tracemalloc.get_traced_memory()[1] if probe else 0
+            tracemalloc.stop()
+        if (response.status_code != scenario.status if scenario.status
+                else response.status_code >= 400):
+            raise CommandError(
+                f'{scenario.name}: {path} вернул {response.status_code}'
+            )
+        if scenario.after:
+            scenario.after(response)
+        return elapsed, len(queries), memory
+
+    def measure(self, scenario, options):
+        for _ in range(options['warmup']):
+            self.request(scenario)
+        timings = [
+            self.request(scenario)[0] * 1000
+            for _ in range(options['requests'])
+        ]
+        _, queries, memory = self.request(scenario, probe=True)
+        result = OrderedDict(
+            (f'p{rank}', round(percentile(timings, rank), 2))
+            for rank in PERCENTILES
+        )
+        result['mean'] = round(sum(timings) / len(timings), 2)
+        result['queries'] = queries
+        result['memory_kb'] = round(memory / 1024, 1)
+        return result
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['p99'] > base['p99'] * (1 + tolerance / 100):
+                regressions.append(
+                    f'{name}: p99 {base["p99"]} -> {result["p99"]} мс'
+                )
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: запросов {base["queries"]} -> '
+                    f'{result["queries"]}'
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['clear_cache']:
+            cache.clear()
+        self.prepare()
+        self.stdout.write(
+            f'Ингредиентов: {Ingredient.objects.count()}, '
+            f'рецептов: {Recipe.objects.count()}'
+        )
+        results = OrderedDict()
+        try:
+            for scenario in self.get_scenarios():
+                if options['only'] and not scenario.name.startswith(
+                    tuple(options['only'])
+                ):
+                    continue
+                results[scenario.name] = result = self.measure(
+                    scenario, options
+                )
+                self.stdout.write(f'{scenario.name:34} ' + ' '.join(
+                    f'{key}={value}' for key, value in result.items()
+                ))
+        finally:
+            Recipe.objects.filter(pk__in=self.created).delete()
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as f:
+                json.dump(
+                    {'requests': options['requests'], 'scenarios': results},
+                    f, ensure_ascii=False, indent=2
+                )
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)['scenarios']
+            regressions = self.compare(
+                results, baseline, options['tolerance']
+            )
+            if regressions:
+                raise CommandError(
+                    'Ухудшения:\n' + '\n'.join(regressions)
+                )
+            self.stdout.write('Ухудшений относительно базовой линии нет')
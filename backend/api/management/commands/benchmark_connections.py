@@ -0,0 +1,64 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.test.utils import override_settings
+
+from api.instrumentation import percentile
+from recipes.models import Tag
+
+MODES = (
+    ('reconnect', True, {}),
+    ('configured', False, {}),
+    ('checked', False, {'DB_HEALTH_CHECK_INTERVAL': 0}),
+)
+
+
+class Command(BaseCommand):
+    help = ('Сравнение накладных расходов на соединение с базой: новое '
+            'соединение на каждый запрос и текущие настройки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Число имитируемых запросов на режим'
+        )
+
+    def drop_connections(self):
+        if connection.connection is not None:
+            connection.connection.close()
+            connection.close()
+        pool = getattr(connection, 'pool', None)
+        if pool is not None:
+            with pool.lock:
+                idle, pool.idle = pool.idle, []
+            for raw, _ in idle:
+                raw.close()
+
+    def cycle(self, reconnect):
+        start = perf_counter()
+        if reconnect:
+            self.drop_connections()
+        request_started.send(sender=self.__class__)
+        list(Tag.objects.all())
+        request_finished.send(sender=self.__class__)
+        return (perf_counter() - start) * 1000
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        self.stdout.write(
+            f'{settings_dict["ENGINE"]}, CONN_MAX_AGE='
+            f'{settings_dict["CONN_MAX_AGE"]}'
+        )
+        for name, reconnect, overrides in MODES:
+            with override_settings(**overrides):
+                self.cycle(reconnect)
+                timings = [
+                    self.cycle(reconnect) for _ in range(options['requests'])
+                ]
+            self.stdout.write(
+                f'{name:12} p50={percentile(timings, 50):.3f} '
+                f'p99={percentile(timings, 99):.3f} '
+                f'mean={sum(timings) / len(timings):.3f} мс'
+            )
@@ -0,0 +1,109 @@
+import random
+import resource
+from collections import OrderedDict
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from rest_framework.settings import api_settings
+
+from api.instrumentation import percentile
+from api.search import CookIndex
+
+PERCENTILES = (50, 90, 99)
+PAGE_SIZE = api_settings.PAGE_SIZE
+
+
+def timed(action):
+    start = perf_counter()
+    result = action()
+    return (perf_counter() - start) * 1000, result
+
+
+def first_page(index, ingredients):
+    ranking = index.rank(ingredients)
+    ranking[:PAGE_SIZE]
+    return ranking
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер индекса «что приготовить» на синтетических данных '
+        'без обращения к базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument(
+            '--per-recipe', type=int, default=8,
+            help='Среднее число ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--pantry', type=int, default=20,
+            help='Число ингредиентов в запросе'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=20,
+            help='Число замеров на сценарий'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def links(self, rng, recipes, ingredients, per_recipe):
+        population = range(1, ingredients + 1)
+        weights = [1 / number for number in population]
+        for recipe in range(1, recipes + 1):
+            size = rng.randint(max(per_recipe // 2, 1), per_recipe * 3 // 2)
+            for ingredient in set(rng.choices(population, weights, k=size)):
+                yield recipe, ingredient
+
+    def report(self, name, timings):
+        result = OrderedDict(
+            (f'p{rank}', round(percentile(timings, rank), 2))
+            for rank in PERCENTILES
+        )
+        result['mean'] = round(sum(timings) / len(timings), 2)
+        self.stdout.write(f'{name:24} ' + ' '.join(
+            f'{key}={value}' for key, value in result.items()
+        ))
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        recipes, ingredients = options['recipes'], options['ingredients']
+        links = list(self.links(
+            rng, recipes, ingredients, options['per_recipe']
+        ))
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        elapsed, index = timed(lambda: CookIndex.build(links))
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+        links = len(links)
+        self.stdout.write(
+            f'Рецептов: {recipes}, ингредиентов: {ingredients}, '
+            f'связей: {links}, построение {elapsed / 1000:.1f} с, '
+            f'память ~{memory // 1024} МБ'
+        )
+        pantries = (
+            ('rank-popular', lambda: range(1, options['pantry'] + 1)),
+            ('rank-random', lambda: rng.sample(
+                range(1, ingredients + 1), options['pantry']
+            )),
+        )
+        for name, pantry in pantries:
+            timings, found = [], 0
+            for _ in range(options['requests']):
+                elapsed, ranking = timed(
+                    lambda items=pantry(): first_page(index, items)
+                )
+                timings.append(elapsed)
+                found = max(found, len(ranking))
+            self.report(f'{name} ({found})', timings)
+        timings = []
+        for _ in range(options['requests']):
+            recipe = rng.randint(1, recipes)
+            changed = [(recipe, ingredient) for ingredient in rng.sample(
+                range(1, ingredients + 1), options['per_recipe']
+            )]
+            elapsed, index = timed(
+                lambda: index.update((recipe,), changed)
+            )
+            timings.append(elapsed)
+        self.report('update-one', timings)
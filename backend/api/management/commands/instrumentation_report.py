@@ -0,0 +1,96 @@
+import json
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.instrumentation import percentile
+
+SORT_KEYS = {
+    'total': lambda row: row['sum_ms'],
+    'p99': lambda row: row['p99'],
+    'queries': lambda row: row['queries'],
+    'duplicates': lambda row: row['duplicates'],
+}
+
+
+def read_records(files):
+    for file in files:
+        for line in file:
+            start = line.find('{')
+            if start == -1:
+                continue
+            try:
+                record = json.loads(line[start:])
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'total_ms' in record:
+                yield record
+
+
+class Command(BaseCommand):
+    help = 'Сводка по маршрутам из журналов InstrumentationMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Файлы журналов, по умолчанию стандартный ввод'
+        )
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument(
+            '--sort', choices=tuple(SORT_KEYS), default='total'
+        )
+
+    def summarize(self, records):
+        routes = defaultdict(list)
+        for record in records:
+            routes[(record['route'], record['method'])].append(record)
+        overall = sum(
+            record['total_ms'] for group in routes.values() for record in group
+        ) or 1
+        for (route, method), group in routes.items():
+            totals = [record['total_ms'] for record in group]
+            yield {
+                'route': f'{method} {route}',
+                'count': len(group),
+                'sum_ms': sum(totals),
+                'share': round(100 * sum(totals) / overall, 1),
+                'p50': percentile(totals, 50),
+                'p95': percentile(totals, 95),
+                'p99': percentile(totals, 99),
+                'queries': round(
+                    sum(record['queries'] for record in group) / len(group), 1
+                ),
+                'db_ms': round(
+                    sum(record['db_ms'] for record in group) / len(group), 1
+                ),
+                'serialize_ms': round(sum(
+                    record.get('serialize_ms', 0) for record in group
+                ) / len(group), 1),
+                'duplicates': round(sum(
+                    record.get('duplicates', 0) for record in group
+                ) / len(group), 1),
+            }
+
+    def handle(self, *args, **options):
+        files = []
+        try:
+            files = [open(path, encoding='utf-8') for path in options['paths']]
+            rows = list(self.summarize(read_records(files or [sys.stdin])))
+        except OSError as error:
+            raise CommandError(error)
+        finally:
+            for file in files:
+                file.close()
+        if not rows:
+            raise CommandError('В журналах нет записей инструментирования')
+        rows.sort(key=SORT_KEYS[options['sort']], reverse=True)
+        columns = ('count', 'share', 'p50', 'p95', 'p99', 'queries', 'db_ms',
+                   'serialize_ms', 'duplicates')
+        self.stdout.write(f'{"route":45}' + ''.join(
+            f'{column:>13}' for column in columns
+        ))
+        for row in rows[:options['top']]:
+            self.stdout.write(f'{row["route"]:45}' + ''.join(
+                f'{row[column]:>13}' for column in columns
+            ))
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+METRICS = {
+    'foodgram_request_duration_seconds': (
+        'histogram', 'Время обработки запроса'
+    ),
+    'foodgram_relation_changes_total': (
+        'counter', 'Изменения избранного, списков покупок и подписок'
+    ),
+    'foodgram_shopping_cart_download_bytes': (
+        'histogram', 'Размер выгруженного списка покупок'
+    ),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кешам приложения'
+    ),
+    'foodgram_db_connections_opened_total': (
+        'counter', 'Открытые соединения с базой данных'
+    ),
+    'foodgram_db_connections': (
+        'gauge', 'Соединения с базой данных, открытые сейчас'
+    ),
+    'foodgram_db_pool_connections': (
+        'gauge', 'Соединения в пуле по состоянию'
+    ),
+    'foodgram_db_pool_wait_seconds': (
+        'histogram', 'Ожидание свободного соединения в пуле'
+    ),
+    'foodgram_db_pool_timeouts_total': (
+        'counter', 'Отказы из-за исчерпания пула'
+    ),
+}
+
+
+def series_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+        self.flushed = 0
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[(name, series_key(labels))] += value
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self.gauges[(name, series_key(labels))] = value
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            key = (name, series_key(labels))
+            if key not in self.histograms:
+                self.histograms[key] = [list(buckets), [0] * len(buckets),
+                                        0, 0]
+            bounds, counts, _, _ = histogram = self.histograms[key]
+            for index, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            histogram[2] += value
+            histogram[3] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[*key, value]
+                             for key, value in self.counters.items()],
+                'gauges': [[*key, value]
+                           for key, value in self.gauges.items()],
+                'histograms': [[*key, *histogram]
+                               for key, histogram in self.histograms.items()],
+            }
+
+    def flush(self, force=False):
+        now = monotonic()
+        if not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed = now
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, ensure_ascii=False)
+        os.replace(f'{path}.tmp', path)
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, labels, value)
+
+
+def observe_stream(chunks, name, buckets=SIZE_BUCKETS, **labels):
+    size = 0
+    for chunk in chunks:
+        size += len(chunk.encode()) if isinstance(chunk, str) else len(chunk)
+        yield chunk
+    registry.observe(name, labels, size, buckets)
+
+
+def record_connections():
+    for connection in connections.all():
+        registry.set(
+            'foodgram_db_connections', {'alias': connection.alias},
+            int(connection.connection is not None)
+        )
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshots():
+    if not os.path.isdir(settings.METRICS_DIR):
+        return
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name),
+                      encoding='utf-8') as file:
+                yield json.load(file)
+        except (OSError, ValueError):
+            continue
+
+
+def collect():
+    counters, gauges, histograms = defaultdict(float), defaultdict(float), {}
+    for snapshot in read_snapshots():
+        alive = is_alive(snapshot['pid'])
+        for name, labels, value in snapshot['counters']:
+            counters[(name, series_key(dict(labels)))] += value
+        for name, labels, value in snapshot['gauges'] if alive else ():
+            gauges[(name, series_key(dict(labels)))] += value
+        for name, labels, bounds, counts, total, count in (
+            snapshot['histograms']
+        ):
+            key = (name, series_key(dict(labels)))
+            merged = histograms.setdefault(
+                key, [bounds, [0] * len(bounds), 0, 0]
+            )
+            if merged[0] == bounds:
+                merged[1] = [a + b for a, b in zip(merged[1], counts)]
+                merged[2] += total
+                merged[3] += count
+    return counters, gauges, histograms
+
+
+def format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for key, value in labels
+    ) + '}'
+
+
+def render_histogram(name, labels, bounds, counts, total, count):
+    cumulative = 0
+    for bound, bucket in zip(bounds, counts):
+        cumulative += bucket
+        yield f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}'
+    yield f'{name}_bucket{format_labels(labels, le="+Inf")} {count}'
+    yield f'{name}_sum{format_labels(labels)} {total}'
+    yield f'{name}_count{format_labels(labels)} {count}'
+
+
+def render():
+    counters, gauges, histograms = collect()
+    series = defaultdict(list)
+    for (name, labels), value in list(counters.items()) + list(
+        gauges.items()
+    ):
+        series[name].append(
+            (labels, [f'{name}{format_labels(labels)} {value:g}'])
+        )
+    for (name, labels), histogram in histograms.items():
+        series[name].append(
+            (labels, list(render_histogram(name, labels, *histogram)))
+        )
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for _, rendered in sorted(series.get(name, ())):
+            lines.extend(rendered)
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    registry.flush(force=True)
+    return HttpResponse(
+        render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        registry.observe(
+            'foodgram_request_duration_seconds',
+            {
+                'route': match.view_name if match else 'unmatched',
+                'method': request.method,
+            },
+            perf_counter() - start, LATENCY_BUCKETS
+        )
+        record_connections()
+        registry.flush()
+        return response
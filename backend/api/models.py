@@ -0,0 +1,42 @@
+from django.db import models
+
+
+class Catalogue(models.Model):
+    name = models.CharField(
+        verbose_name='Каталог', max_length=32, primary_key=True
+    )
+    version = models.PositiveIntegerField(verbose_name='Версия', default=0)
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталогов'
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.version}'
+
+
+class CatalogueChange(models.Model):
+    catalogue = models.ForeignKey(
+        Catalogue,
+        verbose_name='Каталог',
+        related_name='changes',
+        on_delete=models.CASCADE
+    )
+    version = models.PositiveIntegerField(verbose_name='Версия')
+    object_id = models.PositiveIntegerField(
+        verbose_name='Изменённый объект',
+        null=True
+    )
+
+    class Meta:
+        verbose_name = 'Изменение каталога'
+        verbose_name_plural = 'Изменения каталогов'
+        indexes = (
+            models.Index(
+                fields=('catalogue', 'version'),
+                name='catalogue_change_version_idx'
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.catalogue_id} {self.version}: {self.object_id}'
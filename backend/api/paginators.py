@@ -1,5 +1,225 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+from functools import partial
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from api import metrics
+
+
+class LookaheadPage(Page):
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class CachedCountPaginator(Paginator):
+    approximate = False
+
+    def __init__(self, *args, cache_count=True, count_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_count = cache_count
+        self.count_key = count_key
+
+    def table_rows(self, connection):
+        table = self.object_list.model._meta.db_table
+        key = f'pagination:rows:{table}'
+        rows = cache.get(key)
+        if rows is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    (table,)
+                )
+                rows = int(cursor.fetchone()[0])
+            cache.set(key, rows, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return rows
+
+    def estimate_count(self, sql, params):
+        connection = connections[self.object_list.db]
+        if (connection.vendor != 'postgresql' or self.table_rows(connection)
+                < settings.PAGINATION_APPROXIMATE_COUNT):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+
+    def count_rows(self, sql, params):
+        estimate = self.estimate_count(sql, params)
+        if estimate and estimate >= settings.PAGINATION_APPROXIMATE_COUNT:
+            return estimate, True
+        return self.object_list.count(), False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        if not self.cache_count:
+            return self.object_list.count()
+        query = self.object_list.values('pk').order_by().query
+        try:
+            sql, params = query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'pagination:count:' + md5(
+            (self.count_key or f'{sql}{params}').encode()
+        ).hexdigest()
+        cached = cache.get(key)
+        metrics.inc(
+            'foodgram_cache_requests_total', cache='pagination_count',
+            result='miss' if cached is None else 'hit'
+        )
+        if cached is None:
+            cached = self.count_rows(sql, params)
+            cache.set(key, cached, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        count, self.approximate = cached
+        return count
+
+    def validate_number(self, number):
+        # Число страниц не проверяется: закешированное количество может
+        # отставать от таблицы, а конец списка виден по лишней строке.
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы не является числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objects and (number > 1 or not self.allow_empty_first_page):
+            raise EmptyPage('Страница пуста')
+        return LookaheadPage(
+            objects[:self.per_page], number, self,
+            len(objects) > self.per_page
+        )
 
 
 class PageNumberLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+    def get_count_key(self, request):
+        ignored = (self.page_query_param, self.page_size_query_param)
+        query = urlencode(sorted(
+            (key, sorted(values))
+            for key, values in request.query_params.lists()
+            if key not in ignored
+        ), doseq=True)
+        return f'{request.path}?{query}'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        is_user_specific = getattr(view, 'is_user_specific', None)
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            cache_count=not (is_user_specific and is_user_specific(request)),
+            count_key=self.get_count_key(request)
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('count', self.page.paginator.count),
+            ('count_is_approximate', self.page.paginator.approximate),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        )))
+
+
+class CursorLimitPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+
+class UsernameCursorPagination(CursorLimitPagination):
+    ordering = ('username',)
+
+
+class CursorPaginationMixin:
+    cursor_pagination_class = CursorLimitPagination
+
+    @property
+    def paginator(self):
+        params = self.request.query_params
+        if not hasattr(self, '_paginator') and (
+            params.get('pagination') == 'cursor' or 'cursor' in params
+        ):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+
+class FeedPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param, '')
+        if page_size.isdigit() and int(page_size) > 0:
+            return int(page_size)
+        return api_settings.PAGE_SIZE
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None
+        try:
+            pub_date, pk = b64decode(cursor.encode()).decode().split('|')
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (BinasciiError, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk
+
+    def encode_cursor(self, key):
+        pub_date, pk = key
+        return b64encode(f'{pub_date.isoformat()}|{pk}'.encode()).decode()
+
+    def paginate_feed(self, queryset, authors, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        keys = queryset.feed_keys(
+            authors, page_size + 1, self.decode_cursor(request)
+        )
+        self.next_key = keys[page_size - 1] if len(keys) > page_size else None
+        pks = [pk for _, pk in keys[:page_size]]
+        recipes = queryset.in_bulk(pks)
+        return [recipes[pk] for pk in pks if pk in recipes]
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.next_key)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('next', self.get_next_link()),
+            ('results', data),
+        )))
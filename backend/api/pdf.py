@@ -0,0 +1,253 @@
+import struct
+import zlib
+from functools import lru_cache
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 50
+CMAP_BLOCK = 100
+
+
+class TrueTypeFont:
+    def __init__(self, data):
+        self.data = data
+        tables = {}
+        for number in range(struct.unpack_from('>H', data, 4)[0]):
+            tag, _, offset, length = struct.unpack_from(
+                '>4sIII', data, 12 + 16 * number
+            )
+            tables[tag.decode('latin-1')] = offset
+        head, hhea = tables['head'], tables['hhea']
+        self.units = struct.unpack_from('>H', data, head + 18)[0]
+        self.bbox = [
+            self.scale(value)
+            for value in struct.unpack_from('>4h', data, head + 36)
+        ]
+        ascent, descent = struct.unpack_from('>2h', data, hhea + 4)
+        self.ascent, self.descent = self.scale(ascent), self.scale(descent)
+        metrics = struct.unpack_from('>H', data, hhea + 34)[0]
+        self.widths = [
+            self.scale(width) for width, _ in struct.iter_unpack(
+                '>Hh', data[tables['hmtx']:tables['hmtx'] + 4 * metrics]
+            )
+        ]
+        self.glyphs = self.read_cmap(tables['cmap'])
+
+    def scale(self, value):
+        return value * 1000 // self.units
+
+    def read_cmap(self, cmap):
+        data = self.data
+        for number in range(struct.unpack_from('>H', data, cmap + 2)[0]):
+            platform, encoding, offset = struct.unpack_from(
+                '>HHI', data, cmap + 4 + 8 * number
+            )
+            table = cmap + offset
+            if (platform, encoding) == (3, 1) and struct.unpack_from(
+                '>H', data, table
+            )[0] == 4:
+                return self.read_format4(table)
+        raise ValueError('В шрифте нет таблицы Unicode (формат 4)')
+
+    def read_format4(self, table):
+        data = self.data
+        segments = struct.unpack_from('>H', data, table + 6)[0] // 2
+        ends = table + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        glyphs = {}
+        for segment in range(segments):
+            end, start, delta, range_offset = (
+                struct.unpack_from('>H', data, array + 2 * segment)[0]
+                for array in (ends, starts, deltas, range_offsets)
+            )
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset == 0:
+                    glyph = (code + delta) & 0xFFFF
+                else:
+                    glyph = struct.unpack_from('>H', data, (
+                        range_offsets + 2 * segment + range_offset
+                        + 2 * (code - start)
+                    ))[0]
+                    glyph = (glyph + delta) & 0xFFFF if glyph else 0
+                if glyph:
+                    glyphs[chr(code)] = glyph
+        return glyphs
+
+    def glyph(self, char):
+        return self.glyphs.get(char, 0)
+
+    def width(self, glyph):
+        return self.widths[min(glyph, len(self.widths) - 1)]
+
+    def measure(self, text, size):
+        return sum(self.width(self.glyph(char)) for char in text) * size / 1000
+
+
+@lru_cache(maxsize=None)
+def load_font(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    return TrueTypeFont(data), zlib.compress(data)
+
+
+def wrap(font, text, size, width):
+    line = ''
+    for word in text.split(' '):
+        candidate = f'{line} {word}' if line else word
+        if line and font.measure(candidate, size) > width:
+            yield line
+            line = word
+        else:
+            line = candidate
+    yield line
+
+
+class PDFWriter:
+    def __init__(self, font, compressed_font):
+        self.font = font
+        self.compressed_font = compressed_font
+        self.offset = 0
+        self.offsets = {}
+        self.used = {}
+        self.pages = []
+        self.count = 0
+
+    def reserve(self):
+        self.count += 1
+        return self.count
+
+    def write(self, data):
+        self.offset += len(data)
+        return data
+
+    def object(self, number, body):
+        self.offsets[number] = self.offset
+        return self.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+
+    def stream(self, number, dictionary, data):
+        return self.object(number, (
+            b'<< %s /Length %d >>\nstream\n%s\nendstream'
+        ) % (dictionary, len(data), data))
+
+    def encode(self, text):
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyph(char)
+            self.used.setdefault(glyph, char)
+            glyphs.append(b'%04X' % glyph)
+        return b'<' + b''.join(glyphs) + b'>'
+
+    def text(self, x, y, size, text):
+        return b'BT /F1 %d Tf %d %d Td %s Tj ET\n' % (
+            size, x, y, self.encode(text)
+        )
+
+    def page(self, content):
+        contents, page = self.reserve(), self.reserve()
+        self.pages.append(page)
+        return self.stream(
+            contents, b'/Filter /FlateDecode', zlib.compress(content)
+        ) + self.object(page, (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+        ) % (PAGE_WIDTH, PAGE_HEIGHT, contents))
+
+    def to_unicode(self):
+        items = sorted(self.used.items())
+        blocks = []
+        for start in range(0, len(items), CMAP_BLOCK):
+            block = items[start:start + CMAP_BLOCK]
+            blocks.append(b'%d beginbfchar\n%s\nendbfchar' % (
+                len(block), b'\n'.join(
+                    b'<%04X> <%s>' % (
+                        glyph, char.encode('utf-16-be').hex().encode()
+                    )
+                    for glyph, char in block
+                )
+            ))
+        return (
+            b'/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n'
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            b'/Supplement 0 >> def\n/CMapName /Adobe-Identity-UCS def\n'
+            b'/CMapType 2 def\n1 begincodespacerange\n<0000> <FFFF>\n'
+            b'endcodespacerange\n%s\nendcmap\n'
+            b'CMapName currentdict /CMap defineresource pop end end'
+        ) % b'\n'.join(blocks)
+
+    def fonts(self):
+        font = self.font
+        widths = b' '.join(
+            b'%d [%d]' % (glyph, font.width(glyph))
+            for glyph in sorted(self.used)
+        )
+        return b''.join((
+            self.object(3, (
+                b'<< /Type /Font /Subtype /Type0 /BaseFont /ShoppingCartFont '
+                b'/Encoding /Identity-H /DescendantFonts [4 0 R] '
+                b'/ToUnicode 7 0 R >>'
+            )),
+            self.object(4, (
+                b'<< /Type /Font /Subtype /CIDFontType2 '
+                b'/BaseFont /ShoppingCartFont /CIDSystemInfo << '
+                b'/Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+                b'/FontDescriptor 5 0 R /CIDToGIDMap /Identity /W [%s] >>'
+            ) % widths),
+            self.object(5, (
+                b'<< /Type /FontDescriptor /FontName /ShoppingCartFont '
+                b'/Flags 4 /FontBBox [%d %d %d %d] /ItalicAngle 0 '
+                b'/Ascent %d /Descent %d /CapHeight %d /StemV 80 '
+                b'/FontFile2 6 0 R >>'
+            ) % (*font.bbox, font.ascent, font.descent, font.ascent)),
+            self.stream(
+                6, b'/Filter /FlateDecode /Length1 %d' % len(font.data),
+                self.compressed_font
+            ),
+            self.stream(
+                7, b'/Filter /FlateDecode', zlib.compress(self.to_unicode())
+            ),
+        ))
+
+    def close(self):
+        yield self.object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % page for page in self.pages),
+            len(self.pages)
+        ))
+        yield self.fonts()
+        yield self.object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref = self.offset
+        yield self.write(b'xref\n0 %d\n0000000000 65535 f \n%s' % (
+            self.count + 1, b''.join(
+                b'%010d 00000 n \n' % self.offsets[number]
+                for number in range(1, self.count + 1)
+            )
+        ))
+        yield self.write(
+            b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (self.count + 1, xref)
+        )
+
+    def render(self, title, lines, size, title_size):
+        for _ in range(7):
+            self.reserve()
+        yield self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        width = PAGE_WIDTH - 2 * MARGIN
+        leading = size * 3 // 2
+        y = PAGE_HEIGHT - MARGIN - title_size
+        content = self.text(MARGIN, y, title_size, title)
+        y -= title_size * 2
+        for line in lines:
+            for part in wrap(self.font, line, size, width):
+                if y < MARGIN:
+                    yield self.page(content)
+                    content, y = b'', PAGE_HEIGHT - MARGIN - size
+                content += self.text(MARGIN, y, size, part)
+                y -= leading
+        yield self.page(content)
+        yield from self.close()
+
+
+def render_pdf(font_path, title, lines, size=11, title_size=14):
+    return PDFWriter(*load_font(font_path)).render(
+        title, lines, size, title_size
+    )
@@ -0,0 +1,86 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api import metrics
+from api.caches import get_generations, shared_timeout
+
+RELATIONS = {
+    'favorites': lambda user: user.favorites.values_list('id', flat=True),
+    'carts': lambda user: user.carts.values_list('id', flat=True),
+    'subscriptions': lambda user: user.subscribe.values_list('id', flat=True),
+}
+
+
+def generation_key(user_id, kind):
+    return f'relations:{user_id}:{kind}:generation'
+
+
+def relations_key(user_id, kind, generation):
+    return f'relations:{user_id}:{kind}:{generation}'
+
+
+def pack(ids):
+    return array('q', sorted(ids)).tobytes()
+
+
+def unpack(value):
+    ids = array('q')
+    ids.frombytes(value)
+    return frozenset(ids)
+
+
+class UserRelations:
+    def __init__(self, user):
+        self.user = user
+        self.favorites = self.carts = self.subscriptions = frozenset()
+        if user.is_authenticated:
+            self.load()
+
+    def load(self):
+        # Поколение читается до запроса к базе: набор, прочитанный до
+        # изменения, запишется под уже сброшенным поколением.
+        timeout = shared_timeout(settings.RELATIONS_CACHE_TIMEOUT)
+        generations = get_generations(
+            [generation_key(self.user.pk, kind) for kind in RELATIONS],
+            timeout
+        )
+        keys = {
+            relations_key(
+                self.user.pk, kind,
+                generations[generation_key(self.user.pk, kind)]
+            ): kind
+            for kind in RELATIONS
+        }
+        found = cache.get_many(keys)
+        missing = {}
+        for key, kind in keys.items():
+            if key not in found:
+                found[key] = missing[key] = pack(RELATIONS[kind](self.user))
+            setattr(self, kind, unpack(found[key]))
+        metrics.inc(
+            'foodgram_cache_requests_total', len(keys) - len(missing),
+            cache='relations', result='hit'
+        )
+        if missing:
+            metrics.inc(
+                'foodgram_cache_requests_total', len(missing),
+                cache='relations', result='miss'
+            )
+            cache.set_many(missing, timeout)
+
+
+def get_relations(request):
+    relations = getattr(request, '_user_relations', None)
+    if relations is None or relations.user is not request.user:
+        relations = UserRelations(request.user)
+        request._user_relations = relations
+    return relations
+
+
+def invalidate(kind, user_ids):
+    keys = [generation_key(user_id, kind) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,82 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from api.pdf import render_pdf
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(ABC, BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(
+            self.charset or 'utf-8'
+        )
+
+    @abstractmethod
+    def stream(self, user, rows):
+        pass
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, user, rows):
+        yield f'Список покупок {str(user)}\n\n'
+        for row in rows:
+            yield f'{row["ing"]} ({row["unit"]}) - {row["cnt"]}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, user, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Единицы измерения', 'Количество')
+        )
+        for row in rows:
+            yield writer.writerow((row['ing'], row['unit'], row['cnt']))
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, user, rows):
+        separator = '['
+        for row in rows:
+            yield separator + json.dumps(
+                {
+                    'name': row['ing'],
+                    'measurement_unit': row['unit'],
+                    'amount': row['cnt'],
+                },
+                ensure_ascii=False
+            )
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, user, rows):
+        return render_pdf(
+            settings.SHOPPING_PDF_FONT, f'Список покупок {str(user)}',
+            (f'{row["ing"]} ({row["unit"]}) - {row["cnt"]}' for row in rows)
+        )
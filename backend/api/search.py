@@ -0,0 +1,243 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from heapq import nsmallest
+from operator import neg, sub, truediv
+
+from django.db import models
+
+from api import catalogue
+from recipes.models import (SEARCH_TOKEN_RE, Ingredient, Recipe,
+                            RecipeIngredientLink)
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е').strip()
+
+
+def tokenize(text):
+    return SEARCH_TOKEN_RE.findall(normalize(text))
+
+
+def prefix_range(keys, query):
+    start = bisect_left(keys, query)
+    end = bisect_left(keys, query + '\U0010ffff', lo=start)
+    return start, end
+
+
+class IngredientIndex:
+    def __init__(self, ingredients):
+        self.entries = sorted(
+            (normalize(name), name, unit, pk)
+            for pk, name, unit in ingredients
+        )
+        self.keys = [entry[0] for entry in self.entries]
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+        self.text = '\n'.join(self.keys)
+
+    def substring_positions(self, query):
+        position = self.text.find(query)
+        while position != -1:
+            index = bisect_right(self.offsets, position) - 1
+            if not self.keys[index].startswith(query):
+                yield index
+            if index + 1 == len(self.offsets):
+                return
+            position = self.text.find(query, self.offsets[index + 1])
+
+    def search(self, query, limit=None):
+        query = normalize(query)
+        if not query or '\n' in query:
+            return []
+        start, end = prefix_range(self.keys, query)
+        found = list(range(start, end))[:limit]
+        if limit is None or len(found) < limit:
+            for index in self.substring_positions(query):
+                found.append(index)
+                if len(found) == limit:
+                    break
+        return [
+            Ingredient(id=pk, name=name, measurement_unit=unit)
+            for _, name, unit, pk in map(self.entries.__getitem__, found)
+        ]
+
+
+def get_ingredient_index():
+    return catalogue.get_local('ingredients', 'index', lambda: IngredientIndex(
+        Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ).iterator()
+    ))
+
+
+class RecipeIndex:
+    weights = (3, 1, 2)
+
+    def __init__(self, recipes):
+        self.postings = defaultdict(dict)
+        for pk, *fields in recipes:
+            for weight, field in zip(self.weights, fields):
+                for token in tokenize(field):
+                    posting = self.postings[token]
+                    posting[pk] = posting.get(pk, 0) + weight
+        self.tokens = sorted(self.postings)
+
+    def match(self, token):
+        start, end = prefix_range(self.tokens, token)
+        scores = defaultdict(int)
+        for key in self.tokens[start:end]:
+            for pk, weight in self.postings[key].items():
+                scores[pk] += weight
+        return scores
+
+    def search(self, term):
+        scores = None
+        for token in tokenize(term):
+            matches = self.match(token)
+            scores = matches if scores is None else {
+                pk: score + matches[pk]
+                for pk, score in scores.items() if pk in matches
+            }
+        return scores or {}
+
+
+def build_recipe_index():
+    ingredients = defaultdict(list)
+    for recipe, name in RecipeIngredientLink.objects.values_list(
+        'recipe', 'ingredients__name'
+    ).iterator():
+        ingredients[recipe].append(name)
+    return RecipeIndex(
+        (pk, name, text, ' '.join(ingredients[pk]))
+        for pk, name, text in Recipe.objects.values_list(
+            'id', 'name', 'text'
+        ).iterator()
+    )
+
+
+def get_recipe_index():
+    return catalogue.get_local('recipes', 'index', build_recipe_index)
+
+
+class CookIndex:
+    def __init__(self, recipes, postings):
+        self.recipes = recipes
+        self.postings = postings
+
+    @classmethod
+    def build(cls, links):
+        recipes = defaultdict(list)
+        postings = defaultdict(set)
+        for recipe, ingredient in links:
+            recipes[recipe].append(ingredient)
+            postings[ingredient].add(recipe)
+        return cls(
+            {recipe: tuple(items) for recipe, items in recipes.items()},
+            dict(postings)
+        )
+
+    def update(self, changed, links):
+        recipes = dict(self.recipes)
+        postings = dict(self.postings)
+        copied = set()
+
+        def posting(ingredient):
+            if ingredient not in copied:
+                copied.add(ingredient)
+                postings[ingredient] = set(postings.get(ingredient, ()))
+            return postings[ingredient]
+
+        for recipe in changed:
+            for ingredient in recipes.pop(recipe, ()):
+                posting(ingredient).discard(recipe)
+        added = defaultdict(list)
+        for recipe, ingredient in links:
+            added[recipe].append(ingredient)
+            posting(ingredient).add(recipe)
+        for recipe, items in added.items():
+            recipes[recipe] = tuple(items)
+        return CookIndex(recipes, postings)
+
+    def rank(self, ingredients):
+        matches = Counter()
+        for ingredient in ingredients:
+            matches.update(self.postings.get(ingredient, ()))
+        return CookRanking(matches, self.recipes)
+
+
+class CookRanking:
+    def __init__(self, matches, recipes):
+        self.matches = matches
+        self.recipes = recipes
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(len(self))
+        recipes = list(self.matches)
+        counts = list(self.matches.values())
+        totals = list(map(len, map(self.recipes.__getitem__, recipes)))
+        keys = zip(
+            map(neg, map(truediv, counts, totals)),
+            map(sub, totals, counts),
+            map(neg, recipes)
+        )
+        return [
+            (-coverage, missing, -recipe)
+            for coverage, missing, recipe in nsmallest(stop, keys)[start:]
+        ]
+
+
+def cook_links(recipes=None):
+    links = RecipeIngredientLink.objects.order_by()
+    if recipes is not None:
+        links = links.filter(recipe__in=recipes)
+    return links.values_list('recipe', 'ingredients').iterator()
+
+
+class CookQueryRanking:
+    def __init__(self, ingredients):
+        matched = models.Count(
+            'pk', filter=models.Q(ingredients__in=ingredients)
+        )
+        self.queryset = RecipeIngredientLink.objects.filter(
+            recipe__in=RecipeIngredientLink.objects.filter(
+                ingredients__in=ingredients
+            ).values('recipe')
+        ).values('recipe').annotate(
+            matched=matched, total=models.Count('pk')
+        ).annotate(
+            coverage=models.ExpressionWrapper(
+                models.F('matched') * 1.0 / models.F('total'),
+                output_field=models.FloatField()
+            ),
+            missing=models.F('total') - models.F('matched')
+        ).order_by('-coverage', 'missing', '-recipe_id').values_list(
+            'coverage', 'missing', 'recipe'
+        )
+
+    def __len__(self):
+        return self.queryset.count()
+
+    def __getitem__(self, index):
+        return list(self.queryset[index])
+
+
+def get_cook_index():
+    return catalogue.get_local(
+        'recipes', 'cook',
+        lambda: CookIndex.build(cook_links()),
+        lambda index, changed: index.update(changed, cook_links(changed)),
+        background=True
+    )
+
+
+def rank_cook_recipes(ingredients):
+    index = get_cook_index()
+    if index is None:
+        return CookQueryRanking(ingredients)
+    return index.rank(ingredients)
@@ -2,17 +2,21 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.db.models import F
-from drf_extra_fields.fields import Base64ImageField
-from rest_framework.serializers import (CurrentUserDefault, ModelSerializer,
+from rest_framework.serializers import (CurrentUserDefault, FloatField,
+                                        IntegerField, ModelSerializer,
                                         SerializerMethodField, ValidationError)
 from rest_framework.validators import UniqueTogetherValidator
 
-from recipes.models import Ingredient, Recipe, RecipeIngredientLink, Tag
+from api.fields import CompressedImageField, RenditionsField
+from api.instrumentation import InstrumentedSerializerMixin
+from api.relations import get_relations
+from recipes.models import (Ingredient, Recipe, RecipeIngredientLink,
+                            ShoppingCartItem, Tag)
 
 User = get_user_model()
 
 
-class UserSerializer(ModelSerializer):
+class UserSerializer(InstrumentedSerializerMixin, ModelSerializer):
     is_subscribed = SerializerMethodField(method_name='get_is_subscribed')
 
     class Meta:
@@ -23,10 +27,8 @@ class UserSerializer(ModelSerializer):
         read_only_fields = ('is_subscribed',)
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous or user == obj:
-            return False
-        return user.subscribe.filter(id=obj.id).exists()
+        request = self.context.get('request')
+        return obj.id in get_relations(request).subscriptions
 
     def create(self, validated_data):
         user = User(
@@ -40,7 +42,7 @@ class UserSerializer(ModelSerializer):
         return user
 
 
-class IngredientSerializer(ModelSerializer):
+class IngredientSerializer(InstrumentedSerializerMixin, ModelSerializer):
     class Meta:
         model = Ingredient
         fields = '__all__'
@@ -53,21 +55,23 @@ class IngredientSerializer(ModelSerializer):
         )
 
 
-class TagSerializer(ModelSerializer):
+class TagSerializer(InstrumentedSerializerMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
         read_only_fields = ('name', 'color', 'slug')
 
 
-class RecipeLiteSerializer(ModelSerializer):
+class RecipeLiteSerializer(InstrumentedSerializerMixin, ModelSerializer):
+    image_renditions = RenditionsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_renditions', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class RecipeSerializer(ModelSerializer):
+class RecipeSerializer(InstrumentedSerializerMixin, ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
     author = UserSerializer(read_only=True, default=CurrentUserDefault())
@@ -76,14 +80,16 @@ class RecipeSerializer(ModelSerializer):
     is_in_shopping_cart = SerializerMethodField(
         method_name='get_is_in_shopping_cart'
     )
-    image = Base64ImageField()
+    image = CompressedImageField()
+    image_renditions = RenditionsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
-        read_only_fields = ('is_favorite', 'is_shopping_cart', 'author')
+                  'is_in_shopping_cart', 'name', 'image', 'image_renditions',
+                  'text', 'cooking_time', 'favorites_count', 'carts_count')
+        read_only_fields = ('is_favorite', 'is_shopping_cart', 'author',
+                            'favorites_count', 'carts_count')
         validators = (
             UniqueTogetherValidator(
                 queryset=Recipe.objects.all(),
@@ -92,83 +98,133 @@ class RecipeSerializer(ModelSerializer):
         )
 
     def get_ingredients(self, obj):
-        return obj.ingredients.values(
-            'id', 'name', 'measurement_unit', amount=F('recipe__amount')
-        )
+        if 'ingredient' not in getattr(obj, '_prefetched_objects_cache', {}):
+            return obj.ingredients.values(
+                'id', 'name', 'measurement_unit', amount=F('recipe__amount')
+            )
+        return [
+            {
+                'id': link.ingredients.id,
+                'name': link.ingredients.name,
+                'measurement_unit': link.ingredients.measurement_unit,
+                'amount': link.amount,
+            }
+            for link in obj.ingredient.all()
+        ]
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorites.filter(id=obj.id).exists()
+        request = self.context.get('request')
+        return obj.id in get_relations(request).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.carts.filter(id=obj.id).exists()
-
-    def validate(self, data):  # noqa: max-complexity: 11
-        name = self.initial_data.get('name')
-        tags = self.initial_data.get('tags')
-        ingredients = self.initial_data.get('ingredients')
+        request = self.context.get('request')
+        return obj.id in get_relations(request).carts
 
-        if not isinstance(tags, list):
-            raise ValidationError('Некорректный список тэгов')
-        if not isinstance(ingredients, list):
-            raise ValidationError('Некорректный список ингредиентов')
-
-        for tag in tags:
-            if not Tag.objects.filter(id=tag).exists():
-                raise ValidationError(f'некорректный тэг {tag}')
-
-        cooking_time = str(self.initial_data.get('cooking_time'))
-        if not cooking_time.isdigit():
-            raise ValidationError(
-                'Время приготовления не является целым числом'
-            )
-        if int(cooking_time) < settings.RECIPE_MIN_COOKING_TIME:
+    def check_tags(self, tags):
+        found = Tag.objects.in_bulk(
+            [tag for tag in tags if str(tag).isdigit()]
+        )
+        wrong = [
+            tag for tag in tags
+            if not str(tag).isdigit() or int(tag) not in found
+        ]
+        if wrong:
             raise ValidationError(
-                f'Время приготовления менее {settings.RECIPE_MIN_COOKING_TIME}'
+                f'некорректные тэги {", ".join(map(str, wrong))}'
             )
-
+        return tags
+
+    def check_ingredients(self, ingredients):
+        found = Ingredient.objects.in_bulk([
+            ingr.get('id') for ingr in ingredients
+            if str(ingr.get('id')).isdigit()
+        ])
+        errors = []
+        seen = set()
         valid_ingredient = []
         for ingr in ingredients:
             ingr_id = ingr.get('id')
-            ingredient_queryset = Ingredient.objects.filter(id=ingr_id)
-            if not ingredient_queryset.exists():
-                raise ValidationError(f'некорректный ингредиент {ingr}')
-            ingredient = ingredient_queryset[0]
+            ingredient = (
+                found.get(int(ingr_id)) if str(ingr_id).isdigit() else None
+            )
+            if ingredient is None:
+                errors.append(f'некорректный ингредиент {ingr}')
+                continue
 
             amount = str(ingr.get('amount'))
             if not amount.isdigit():
-                raise ValidationError(
+                errors.append(
                     f'Кол-во у <{ingredient.name}> не является целым числом'
                 )
-            if int(amount) < settings.RECIPE_MIN_AMOUNT:
-                raise ValidationError(
+            elif int(amount) < settings.RECIPE_MIN_AMOUNT:
+                errors.append(
                     f'Кол-во у <{ingredient.name}> меньше '
                     f'{settings.RECIPE_MIN_AMOUNT}'
                 )
-
-            ingr_exist = filter(
-                lambda item: item['ingredient'] == ingredient, valid_ingredient
-            )
-            if len(list(ingr_exist)) != 0:
-                raise ValidationError(
-                    f'<{ingredient.name}> повторяется в рецепте'
-                )
+            if ingredient.id in seen:
+                errors.append(f'<{ingredient.name}> повторяется в рецепте')
+            seen.add(ingredient.id)
 
             valid_ingredient.append(
                 {'ingredient': ingredient, 'amount': amount}
             )
+        if errors:
+            raise ValidationError(errors)
+        return valid_ingredient
+
+    def validate(self, data):
+        name = self.initial_data.get('name')
+        tags = self.initial_data.get('tags')
+        ingredients = self.initial_data.get('ingredients')
+
+        if not isinstance(tags, list):
+            raise ValidationError('Некорректный список тэгов')
+        if not isinstance(ingredients, list) or not all(
+            isinstance(ingr, dict) for ingr in ingredients
+        ):
+            raise ValidationError('Некорректный список ингредиентов')
+
+        cooking_time = str(self.initial_data.get('cooking_time'))
+        if not cooking_time.isdigit():
+            raise ValidationError(
+                'Время приготовления не является целым числом'
+            )
+        if int(cooking_time) < settings.RECIPE_MIN_COOKING_TIME:
+            raise ValidationError(
+                f'Время приготовления менее {settings.RECIPE_MIN_COOKING_TIME}'
+            )
 
         data['name'] = name
-        data['tags'] = tags
-        data['ingredients'] = valid_ingredient
+        data['tags'] = self.check_tags(tags)
+        data['ingredients'] = self.check_ingredients(ingredients)
         data['author'] = self.context.get('request').user
         return data
 
+    def save_ingredients(self, recipe, ingredients):
+        links = {link.ingredients_id: link for link in recipe.ingredient.all()}
+        amounts = {
+            item['ingredient'].id: int(item['amount']) for item in ingredients
+        }
+        removed = links.keys() - amounts.keys()
+        added = amounts.keys() - links.keys()
+        changed = [
+            links[ingr_id] for ingr_id in links.keys() & amounts.keys()
+            if links[ingr_id].amount != amounts[ingr_id]
+        ]
+        for link in changed:
+            link.amount = amounts[link.ingredients_id]
+
+        if removed:
+            recipe.ingredient.filter(ingredients__in=removed).delete()
+        RecipeIngredientLink.objects.bulk_create(
+            RecipeIngredientLink(
+                recipe=recipe, ingredients_id=ingr_id, amount=amounts[ingr_id]
+            )
+            for ingr_id in added
+        )
+        RecipeIngredientLink.objects.bulk_update(changed, ('amount',))
+        return removed | added | {link.ingredients_id for link in changed}
+
     @transaction.atomic
     def create(self, validated_data):
         image = validated_data.pop('image')
@@ -176,14 +232,8 @@ class RecipeSerializer(ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(image=image, **validated_data)
         recipe.tags.set(tags)
-
-        for ingredient in ingredients:
-            RecipeIngredientLink.objects.get_or_create(
-                recipe=recipe,
-                ingredients=ingredient['ingredient'],
-                amount=ingredient['amount']
-            )
-
+        self.save_ingredients(recipe, ingredients)
+        Recipe.objects.filter(pk=recipe.pk).refresh_search_vectors()
         return recipe
 
     @transaction.atomic
@@ -191,7 +241,9 @@ class RecipeSerializer(ModelSerializer):
         tags = validated_data.get('tags')
         ingredients = validated_data.get('ingredients')
 
-        recipe.image = validated_data.get('image', recipe.image)
+        if 'image' in validated_data:
+            recipe.image = validated_data['image']
+            recipe.renditions_ready = False
         recipe.name = validated_data.get('name', recipe.name)
         recipe.text = validated_data.get('text', recipe.text)
         recipe.cooking_time = validated_data.get(
@@ -199,21 +251,27 @@ class RecipeSerializer(ModelSerializer):
         )
 
         if tags:
-            recipe.tags.clear()
             recipe.tags.set(tags)
 
         if ingredients:
-            recipe.ingredients.clear()
-            for ingredient in ingredients:
-                RecipeIngredientLink.objects.get_or_create(
-                    recipe=recipe,
-                    ingredients=ingredient['ingredient'],
-                    amount=ingredient['amount']
+            changed = self.save_ingredients(recipe, ingredients)
+            if changed:
+                ShoppingCartItem.objects.refresh(
+                    users=recipe.cart.values('id'), ingredients=changed
                 )
         recipe.save()
+        Recipe.objects.filter(pk=recipe.pk).refresh_search_vectors()
         return recipe
 
 
+class RecipeCookSerializer(RecipeSerializer):
+    coverage = FloatField(read_only=True)
+    missing_count = IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing_count')
+
+
 class UserSubscribeSerializer(UserSerializer):
     recipes = RecipeLiteSerializer(many=True, read_only=True)
     recipes_count = SerializerMethodField(method_name='get_recipes_count')
@@ -230,4 +288,6 @@ class UserSubscribeSerializer(UserSerializer):
         return True
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
@@ -0,0 +1,170 @@
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import authentication, catalogue, counters, metrics, relations
+from recipes.images import renditions_ready
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.signals import (counters_refreshed, ingredients_imported,
+                             recipes_imported)
+
+User = get_user_model()
+RELATION_THROUGH = {
+    Recipe.favorite.through: ('favorites', False, 'recipe', 'user'),
+    Recipe.cart.through: ('carts', False, 'recipe', 'user'),
+    User.subscribe.through: ('subscriptions', True, 'to_user', 'from_user'),
+}
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver((post_save, post_delete, ingredients_imported), sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    catalogue.invalidate('ingredients')
+    catalogue.invalidate('recipes')
+    catalogue.invalidate('recipe_responses')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    catalogue.invalidate('tags')
+    catalogue.invalidate('recipe_responses')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipes(sender, instance, **kwargs):
+    catalogue.invalidate('recipes', changed=(instance.pk,))
+    catalogue.invalidate('recipe_responses')
+
+
+@receiver(recipes_imported, sender=Recipe)
+def invalidate_imported_recipes(sender, **kwargs):
+    catalogue.invalidate('recipes')
+    catalogue.invalidate('recipe_responses')
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+@receiver(m2m_changed, sender=Recipe.cart.through)
+def invalidate_recipe_counters(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            counters.invalidate((instance.pk,))
+    elif action in ('post_add', 'post_remove'):
+        counters.invalidate(pk_set)
+    elif action == 'pre_clear':
+        counters.invalidate(sender.objects.filter(
+            user=instance.pk
+        ).values_list('recipe_id', flat=True))
+
+
+@receiver(counters_refreshed, sender=Recipe)
+def invalidate_refreshed_counters(sender, recipe_ids, **kwargs):
+    counters.invalidate(recipe_ids)
+
+
+@receiver(renditions_ready, sender=Recipe)
+def invalidate_recipe_images(sender, **kwargs):
+    catalogue.invalidate('recipe_responses')
+
+
+def author_state(user):
+    return tuple(getattr(user, field) for field in AUTHOR_FIELDS)
+
+
+@receiver(post_init, sender=User)
+def remember_author(sender, instance, **kwargs):
+    # Чтение отложенного поля само создаёт экземпляр модели, поэтому
+    # неполные экземпляры не запоминаются.
+    if instance.get_deferred_fields() & set(AUTHOR_FIELDS):
+        instance._author_state = None
+    else:
+        instance._author_state = author_state(instance)
+
+
+@receiver(post_save, sender=User)
+def invalidate_authors(sender, instance, created, **kwargs):
+    state = author_state(instance)
+    if created or state == instance._author_state:
+        return
+    instance._author_state = state
+    if Recipe.objects.filter(author=instance).exists():
+        catalogue.invalidate('recipe_responses')
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+@receiver(m2m_changed, sender=Recipe.cart.through)
+@receiver(m2m_changed, sender=User.subscribe.through)
+def invalidate_relations(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    kind, owner_forward, source, owner = RELATION_THROUGH[sender]
+    if reverse != owner_forward:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            relations.invalidate(kind, (instance.pk,))
+    elif action in ('post_add', 'post_remove'):
+        relations.invalidate(kind, pk_set)
+    elif action == 'pre_clear':
+        relations.invalidate(kind, sender.objects.filter(
+            **{source: instance.pk}
+        ).values_list(f'{owner}_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+@receiver(m2m_changed, sender=Recipe.cart.through)
+@receiver(m2m_changed, sender=User.subscribe.through)
+def count_relation_changes(sender, action, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        metrics.inc(
+            'foodgram_relation_changes_total', len(pk_set),
+            relation=RELATION_THROUGH[sender][0], action=action[5:]
+        )
+
+
+@receiver(connection_created)
+def count_db_connections(sender, connection, **kwargs):
+    metrics.inc('foodgram_db_connections_opened_total', alias=connection.alias)
+
+
+@receiver(request_finished)
+def record_db_connections(sender, **kwargs):
+    metrics.record_connections()
+    now = monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.idle_since = now
+
+
+@receiver(request_started)
+def check_db_connections(sender, **kwargs):
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    now = monotonic()
+    for connection in connections.all():
+        if connection.connection is None or (
+            now - getattr(connection, 'idle_since', 0)
+            < settings.DB_HEALTH_CHECK_INTERVAL
+        ):
+            continue
+        if not connection.is_usable():
+            connection.close()
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    authentication.forget((instance.key,))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    authentication.forget(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
@@ -0,0 +1,1149 @@
+import base64
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import (authentication, catalogue, counters, relations,
+                 search)
+from api.authentication import CachedTokenAuthentication
+from api.caches import get_generations
+from api.models import CatalogueChange
+from api.paginators import CachedCountPaginator
+from api.search import CookIndex
+from api.signals import check_db_connections, record_db_connections
+from recipes.images import (delete_unused_image, make_renditions,
+                            rendition_names)
+from recipes.models import (Ingredient, Recipe, RecipeIngredientLink,
+                            ShoppingCartItem, Tag)
+from recipes.storage import ContentAddressedStorage
+
+User = get_user_model()
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@contextmanager
+def run_on_commit():
+    start = len(connection.run_on_commit)
+    yield
+    while len(connection.run_on_commit) > start:
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
+
+def create_user(name):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='password',
+        first_name=name, last_name=name
+    )
+
+
+def image_payload(size=(8, 8)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (120, 180, 90)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def create_recipes(author, count, tags, ingredients):
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            name=f'Рецепт {author.username} {number}', author=author,
+            image='images/test.jpg', text='Описание', cooking_time=10
+        )
+        recipe.tags.set(tags)
+        RecipeIngredientLink.objects.bulk_create(
+            RecipeIngredientLink(
+                recipe=recipe, ingredients=ingredient, amount=number + 1
+            )
+            for ingredient in ingredients
+        )
+        recipes.append(recipe)
+    Recipe.objects.filter(
+        pk__in=[recipe.pk for recipe in recipes]
+    ).refresh_search_vectors()
+    return recipes
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FoodgramTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.tags = [
+            Tag.objects.create(name=f'Тэг {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = create_recipes(
+            cls.author, 2, cls.tags, cls.ingredients
+        )
+        cls.user.favorites.add(cls.recipes[0])
+        cls.user.carts.add(cls.recipes[1])
+        cls.user.subscribe.add(cls.author)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+        catalogue.local_cache.clear()
+        catalogue.local_objects.clear()
+        catalogue.scheduled.clear()
+        executor = mock.patch.object(catalogue, 'executor')
+        self.executor = executor.start()
+        self.addCleanup(executor.stop)
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+class RecipeQueryCountTest(FoodgramTestCase):
+    def setUp(self):
+        super().setUp()
+        self.warm_up()
+
+    def warm_up(self):
+        # Версия ответов и оценка размера таблицы в PostgreSQL кешируются
+        # и не входят в число запросов на каждый ответ.
+        catalogue.get_version('recipe_responses')
+        if connection.vendor == 'postgresql':
+            CachedCountPaginator(Recipe.objects.all(), 1).table_rows(
+                connection
+            )
+
+    def get(self, client, path, queries):
+        with self.assertNumQueries(queries):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_anonymous(self):
+        data = self.get(self.anonymous, '/api/recipes/', 4)
+        self.assertEqual(data['count'], 2)
+        self.assertFalse(data['results'][0]['is_favorited'])
+        self.assertFalse(data['results'][0]['author']['is_subscribed'])
+
+    def test_list_authenticated(self):
+        data = self.get(self.client, '/api/recipes/', 8)
+        flags = {
+            recipe['id']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart'],
+                recipe['author']['is_subscribed']
+            )
+            for recipe in data['results']
+        }
+        self.assertEqual(flags, {
+            self.recipes[0].id: (True, False, True),
+            self.recipes[1].id: (False, True, True),
+        })
+
+    def test_list_does_not_grow_with_page_size(self):
+        create_recipes(create_user('other'), 10, self.tags, self.ingredients)
+        data = self.get(self.anonymous, '/api/recipes/', 4)
+        self.assertEqual(len(data['results']), 12)
+        # Количество уже закешировано: размер страницы в ключ не входит.
+        self.get(self.client, '/api/recipes/?limit=12&page=1', 7)
+
+    def test_detail_anonymous(self):
+        recipe = self.recipes[0]
+        data = self.get(self.anonymous, f'/api/recipes/{recipe.id}/', 3)
+        self.assertEqual(len(data['ingredients']), 3)
+        self.assertEqual(len(data['tags']), 2)
+
+    def test_detail_authenticated(self):
+        recipe = self.recipes[0]
+        data = self.get(self.client, f'/api/recipes/{recipe.id}/', 7)
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+
+    def test_search_vector_is_not_loaded(self):
+        for client in (self.anonymous, self.client):
+            with CaptureQueriesContext(connection) as queries:
+                client.get('/api/recipes/?limit=1')
+            self.assertFalse(any(
+                'search_vector' in query['sql'] for query in queries
+            ))
+
+    def test_cached_responses(self):
+        self.get(self.anonymous, '/api/recipes/', 4)
+        self.get(self.anonymous, '/api/recipes/', 1)
+        self.get(self.anonymous, '/api/recipes/', 0)
+        self.get(self.client, '/api/recipes/', 4)
+        self.get(self.client, '/api/recipes/', 1)
+
+    def test_cached_responses_with_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.warm_up()
+                self.get(self.client, '/api/recipes/', 8)
+                self.get(self.client, '/api/recipes/', 1)
+                self.get(self.client, '/api/recipes/', 0)
+
+
+class PaginationTest(FoodgramTestCase):
+    def count(self, client, path):
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), data['count'])
+        return data['count']
+
+    def test_counts_follow_relation_changes(self):
+        other = create_user('other')
+        recipes = create_recipes(other, 2, self.tags, self.ingredients)
+        cart = '/api/recipes/?is_in_shopping_cart=1'
+        favorites = '/api/recipes/?is_favorited=1'
+        subscriptions = '/api/users/subscriptions/'
+        self.assertEqual(self.count(self.client, cart), 1)
+        self.assertEqual(self.count(self.client, favorites), 1)
+        self.assertEqual(self.count(self.client, subscriptions), 1)
+        self.user.carts.add(*recipes)
+        self.user.favorites.add(*recipes)
+        self.user.subscribe.add(other)
+        self.assertEqual(self.count(self.client, cart), 3)
+        self.assertEqual(self.count(self.client, favorites), 3)
+        self.assertEqual(self.count(self.client, subscriptions), 2)
+
+    @override_settings(PAGINATION_APPROXIMATE_COUNT=1)
+    def test_stale_estimate_does_not_cut_rows(self):
+        create_recipes(create_user('late'), 1, self.tags, self.ingredients)
+        paginator = CachedCountPaginator(Recipe.objects.order_by('pk'), 2)
+        paginator.estimate_count = lambda sql, params: 1
+        self.assertEqual(paginator.count, 1)
+        self.assertTrue(paginator.approximate)
+        first, second = paginator.page(1), paginator.page(2)
+        self.assertEqual(len(first), 2)
+        self.assertTrue(first.has_next())
+        self.assertEqual(len(second), 1)
+        self.assertFalse(second.has_next())
+
+    def test_exact_count_is_cached(self):
+        paginator = CachedCountPaginator(Recipe.objects.order_by('pk'), 1)
+        self.assertEqual(paginator.count, 2)
+        self.assertFalse(paginator.approximate)
+        create_recipes(create_user('late'), 1, self.tags, self.ingredients)
+        paginator = CachedCountPaginator(Recipe.objects.order_by('pk'), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.count, 2)
+        # Устаревшее количество не прячет последнюю страницу.
+        self.assertTrue(paginator.page(2).has_next())
+        self.assertEqual(len(paginator.page(3)), 1)
+        self.assertFalse(paginator.page(3).has_next())
+
+    def test_user_specific_count_is_not_cached(self):
+        paginator = CachedCountPaginator(
+            Recipe.objects.all(), 1, cache_count=False
+        )
+        self.assertEqual(paginator.count, 2)
+        create_recipes(create_user('late'), 1, self.tags, self.ingredients)
+        paginator = CachedCountPaginator(
+            Recipe.objects.all(), 1, cache_count=False
+        )
+        self.assertEqual(paginator.count, 3)
+
+    def test_count_key_ignores_paging_and_order_of_filters(self):
+        path = '/api/recipes/?tags={}&tags={}&limit={}&page=1'
+        first = path.format(self.tags[0].slug, self.tags[1].slug, 1)
+        second = path.format(self.tags[1].slug, self.tags[0].slug, 2)
+        self.assertEqual(self.client.get(first).json()['count'], 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(second)
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'COUNT(' in query['sql']
+        ])
+
+
+class RecipeCountersTest(FoodgramTestCase):
+    def counters(self):
+        return {
+            pk: (favorites, carts)
+            for pk, favorites, carts in Recipe.objects.values_list(
+                'pk', 'favorites_count', 'carts_count'
+            )
+        }
+
+    def assertCounters(self, first, second):
+        self.assertEqual(self.counters(), {
+            self.recipes[0].pk: first, self.recipes[1].pk: second
+        })
+        call_command(
+            'rebuild_recipe_counters', '--check', stdout=StringIO()
+        )
+
+    def test_add_and_remove(self):
+        other = create_user('other')
+        self.assertCounters((1, 0), (0, 1))
+        other.favorites.add(*self.recipes)
+        self.recipes[0].cart.add(self.author, other)
+        self.assertCounters((2, 2), (1, 1))
+        self.recipes[0].favorite.remove(other)
+        other.carts.remove(self.recipes[0])
+        self.assertCounters((1, 1), (1, 1))
+
+    def test_clear(self):
+        self.author.favorites.add(*self.recipes)
+        self.author.carts.add(*self.recipes)
+        self.recipes[0].favorite.clear()
+        self.assertCounters((0, 1), (1, 2))
+        self.author.carts.clear()
+        self.assertCounters((0, 0), (1, 1))
+
+    def test_user_deletion(self):
+        other = create_user('other')
+        other.favorites.add(*self.recipes)
+        other.carts.add(self.recipes[1])
+        self.assertCounters((2, 0), (1, 2))
+        counters.get_counters([recipe.pk for recipe in self.recipes])
+        with run_on_commit():
+            other.delete()
+        self.assertCounters((1, 0), (0, 1))
+        self.assertEqual(
+            counters.get_counters([self.recipes[1].pk]),
+            {self.recipes[1].pk: (0, 1)}
+        )
+
+    def test_counters_read_before_change_are_not_kept(self):
+        recipe = self.recipes[1]
+        get_generations([counters.generation_key(recipe.pk)], None)
+        set_many = cache.set_many
+
+        def change_then_set_many(*args, **kwargs):
+            with run_on_commit():
+                self.user.favorites.add(recipe)
+            return set_many(*args, **kwargs)
+
+        with mock.patch.object(cache, 'set_many', change_then_set_many):
+            stale = counters.get_counters([recipe.pk])
+        self.assertEqual(stale, {recipe.pk: (0, 1)})
+        self.assertEqual(
+            counters.get_counters([recipe.pk]), {recipe.pk: (1, 1)}
+        )
+
+    def test_deleted_user_via_api(self):
+        response = self.client.delete('/api/users/me/', {
+            'current_password': 'password'
+        }, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertCounters((0, 0), (0, 0))
+
+
+class SubscriptionsTest(FoodgramTestCase):
+    def subscriptions(self, query=''):
+        response = self.client.get(f'/api/users/subscriptions/{query}')
+        self.assertEqual(response.status_code, 200)
+        return {
+            author['id']: author for author in response.json()['results']
+        }
+
+    def subscribe(self, count):
+        authors = []
+        for number in range(count):
+            author = create_user(f'writer{number}')
+            create_recipes(author, 3, self.tags, self.ingredients)
+            authors.append(author)
+        self.user.subscribe.add(*authors)
+        return authors
+
+    def test_recipes_limit(self):
+        author, = self.subscribe(1)
+        latest = list(
+            Recipe.objects.filter(author=author).values_list('pk', flat=True)
+        )
+        for query, limit in (('', 3), ('?recipes_limit=2', 2),
+                             ('?recipes_limit=x', 3)):
+            data = self.subscriptions(query)[author.pk]
+            self.assertEqual(
+                [recipe['id'] for recipe in data['recipes']], latest[:limit]
+            )
+            self.assertEqual(data['recipes_count'], 3)
+        data = self.subscriptions('?recipes_limit=1')
+        self.assertEqual(len(data[self.author.pk]['recipes']), 1)
+        self.assertEqual(data[self.author.pk]['recipes_count'], 2)
+
+    def test_query_count_does_not_grow(self):
+        # Токен, страница авторов, их рецепты и количество авторов.
+        with self.assertNumQueries(4):
+            self.assertEqual(len(self.subscriptions('?recipes_limit=2')), 1)
+        self.subscribe(5)
+        with self.assertNumQueries(4):
+            data = self.subscriptions('?recipes_limit=2')
+        self.assertEqual(len(data), 6)
+        self.assertTrue(all(
+            len(author['recipes']) == 2 for author in data.values()
+        ))
+
+
+class FeedTest(FoodgramTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        writers = [create_user(f'writer{number}') for number in range(3)]
+        for number, writer in enumerate(writers):
+            create_recipes(writer, number + 2, cls.tags, cls.ingredients)
+        create_recipes(create_user('stranger'), 2, cls.tags, cls.ingredients)
+        cls.user.subscribe.add(*writers)
+        # Одинаковое время публикации: порядок решает первичный ключ.
+        Recipe.objects.filter(author=writers[1]).update(
+            pub_date=Recipe.objects.filter(
+                author=writers[2]
+            ).values_list('pub_date', flat=True)[0]
+        )
+        cls.expected = list(Recipe.objects.filter(
+            author__in=[cls.author, *writers]
+        ).order_by('-pub_date', '-id').values_list('pk', flat=True))
+
+    def walk(self, limit):
+        path, recipes = f'/api/recipes/feed/?limit={limit}', []
+        while path is not None:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['results']), limit)
+            recipes.extend(recipe['id'] for recipe in data['results'])
+            path = data['next']
+        return recipes
+
+    def test_order_and_cursor_paging(self):
+        self.assertEqual(len(self.expected), 11)
+        for limit in (1, 3, 11, 20):
+            self.assertEqual(self.walk(limit), self.expected)
+
+    def test_merge_strategy(self):
+        features = connection.features
+        for compound in {features.supports_slicing_ordering_in_compound,
+                         False}:
+            with mock.patch.object(
+                features, 'supports_slicing_ordering_in_compound', compound
+            ):
+                self.assertEqual(self.walk(4), self.expected)
+
+    @override_settings(FEED_MERGE_MAX_AUTHORS=2)
+    def test_in_strategy(self):
+        self.assertEqual(self.walk(4), self.expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/feed/?cursor=bad')
+        self.assertEqual(response.status_code, 404)
+
+    def test_anonymous(self):
+        response = self.anonymous.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 401)
+
+
+class ShoppingCartTest(FoodgramTestCase):
+    def assertCartsAreLive(self):
+        stored = {
+            (item['user'], item['ingredient']): item['amount']
+            for item in ShoppingCartItem.objects.values(
+                'user', 'ingredient', 'amount'
+            )
+        }
+        self.assertEqual(stored, {
+            (row['user'], row['ingredients']): row['total']
+            for row in ShoppingCartItem.objects.live()
+        })
+        call_command('rebuild_shopping_carts', '--check', stdout=StringIO())
+        return stored
+
+    def amounts(self, user):
+        return {
+            ingredient: amount
+            for (owner, ingredient), amount
+            in self.assertCartsAreLive().items() if owner == user.pk
+        }
+
+    def test_forward_add_remove_and_clear(self):
+        other = create_user('other')
+        other.carts.add(*self.recipes)
+        self.assertEqual(self.amounts(other), {
+            ingredient.pk: 3 for ingredient in self.ingredients
+        })
+        other.carts.remove(self.recipes[0])
+        self.assertEqual(self.amounts(other), {
+            ingredient.pk: 2 for ingredient in self.ingredients
+        })
+        other.carts.clear()
+        self.assertEqual(self.amounts(other), {})
+        self.assertEqual(len(self.amounts(self.user)), 3)
+
+    def test_reverse_add_remove_and_clear(self):
+        other = create_user('other')
+        self.recipes[0].cart.add(self.user, other)
+        self.assertEqual(self.amounts(self.user), {
+            ingredient.pk: 3 for ingredient in self.ingredients
+        })
+        self.recipes[1].cart.remove(self.user)
+        self.assertEqual(self.amounts(self.user), {
+            ingredient.pk: 1 for ingredient in self.ingredients
+        })
+        self.recipes[0].cart.clear()
+        self.assertEqual(self.amounts(self.user), {})
+        self.assertEqual(self.amounts(other), {})
+
+    def test_ingredient_update_through_serializer(self):
+        added = Ingredient.objects.create(
+            name='Новый продукт', measurement_unit='г'
+        )
+        author = APIClient()
+        author.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(
+            user=self.author
+        ).key)
+        response = author.patch(f'/api/recipes/{self.recipes[1].pk}/', {
+            'name': 'Обновлённый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': self.ingredients[0].pk, 'amount': 5},
+                {'id': added.pk, 'amount': 1},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.amounts(self.user), {
+            self.ingredients[0].pk: 5, added.pk: 1
+        })
+
+    def test_recipe_deletion(self):
+        other = create_user('other')
+        other.carts.add(*self.recipes)
+        Recipe.objects.get(pk=self.recipes[1].pk).delete()
+        self.assertEqual(self.amounts(self.user), {})
+        self.assertEqual(self.amounts(other), {
+            ingredient.pk: 1 for ingredient in self.ingredients
+        })
+
+    def test_ingredient_deletion(self):
+        Ingredient.objects.get(pk=self.ingredients[0].pk).delete()
+        self.assertEqual(self.amounts(self.user), {
+            ingredient.pk: 2 for ingredient in self.ingredients[1:]
+        })
+
+    def download(self, **headers):
+        return self.client.get(
+            '/api/recipes/download_shopping_cart/', **headers
+        )
+
+    def test_last_modified_follows_removals(self):
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        recipe, = create_recipes(create_user('cook'), 1, self.tags, [salt])
+        self.user.carts.add(recipe)
+        for change in (
+            lambda: self.user.carts.remove(recipe),
+            lambda: Ingredient.objects.get(pk=self.ingredients[0].pk).delete()
+        ):
+            ShoppingCartItem.objects.update(
+                modified=datetime(2020, 1, 1, tzinfo=timezone.utc)
+            )
+            response = self.download()
+            self.assertEqual(response.status_code, 200)
+            since = response['Last-Modified']
+            self.assertEqual(since, 'Wed, 01 Jan 2020 00:00:00 GMT')
+            self.assertEqual(
+                self.download(HTTP_IF_MODIFIED_SINCE=since).status_code, 304
+            )
+            change()
+            self.assertEqual(
+                self.download(HTTP_IF_MODIFIED_SINCE=since).status_code, 200
+            )
+
+    def test_empty_cart_has_no_last_modified(self):
+        self.user.carts.clear()
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_check_reports_drift(self):
+        ShoppingCartItem.objects.filter(user=self.user).update(amount=99)
+        with self.assertRaisesMessage(CommandError, 'Расхождений: 3'):
+            call_command(
+                'rebuild_shopping_carts', '--check', stdout=StringIO()
+            )
+        call_command('rebuild_shopping_carts', stdout=StringIO())
+        self.assertEqual(len(self.amounts(self.user)), 3)
+
+
+class RecipeTagFilterTest(FoodgramTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        first, second = cls.tags
+        cls.first_only, = create_recipes(
+            create_user('first'), 1, (first,), cls.ingredients
+        )
+        cls.second_only, = create_recipes(
+            create_user('second'), 1, (second,), cls.ingredients
+        )
+
+    def ids(self, query):
+        response = self.anonymous.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_any_tag_has_no_duplicates(self):
+        ids = self.ids('tags=tag0&tags=tag1')
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), {
+            recipe.id for recipe in self.recipes
+        } | {self.first_only.id, self.second_only.id})
+
+    def test_all_tags(self):
+        ids = self.ids('tags=tag0&tags=tag1&tags_match=all')
+        self.assertEqual(set(ids), {recipe.id for recipe in self.recipes})
+
+    def test_single_and_unknown_tag(self):
+        self.assertEqual(set(self.ids('tags=tag1')), {
+            recipe.id for recipe in self.recipes
+        } | {self.second_only.id})
+        self.assertEqual(self.ids('tags=missing'), [])
+
+    def test_query_count_and_plan(self):
+        self.ids('tags=tag0')
+        with CaptureQueriesContext(connection) as queries:
+            self.ids('tags=tag0&tags=tag1&tags_match=all&limit=5')
+        self.assertEqual(len(queries), 4)
+        for query in queries[:2]:
+            sql = query['sql'].upper()
+            self.assertIn('"RECIPES_RECIPE_TAGS"', sql)
+            for clause in ('DISTINCT', 'GROUP BY', 'JOIN "RECIPES_TAG"'):
+                self.assertNotIn(clause, sql)
+        plan = Recipe.objects.filter(pk__in=Recipe.tags.through.objects.filter(
+            tag__in=self.tags
+        ).values('recipe')).order_by().explain().upper()
+        for step in ('DISTINCT', 'TEMP B-TREE', 'UNIQUE'):
+            self.assertNotIn(step, plan)
+
+
+class RecipeSearchTest(FoodgramTestCase):
+    def test_postgresql_query_matches_prefixes(self):
+        queryset = Recipe.objects.search('Рец, auth-')
+        _, params = queryset.query.sql_with_params()
+        self.assertIn('Рец:* & auth:*', params)
+        self.assertIn('TO_TSQUERY', str(queryset.query).upper())
+        self.assertFalse(Recipe.objects.search(' - ').exists())
+
+    def test_fallback_matches_prefixes(self):
+        response = self.anonymous.get('/api/recipes/?search=рец auth')
+        self.assertEqual(
+            {recipe['id'] for recipe in response.json()['results']},
+            {recipe.id for recipe in self.recipes}
+        )
+
+
+class RecipeValidationTest(FoodgramTestCase):
+    def post(self, ingredients, tags=None):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image_payload(),
+            'tags': [tag.id for tag in self.tags] if tags is None else tags,
+            'ingredients': ingredients,
+        }, format='json')
+        return response.status_code, response.json()
+
+    def test_valid_recipe(self):
+        status, data = self.post([
+            {'id': ingredient.id, 'amount': 2}
+            for ingredient in self.ingredients
+        ])
+        self.assertEqual(status, 201)
+        self.assertEqual(len(data['ingredients']), 3)
+
+    def test_duplicate_ingredient(self):
+        ingredient = self.ingredients[0]
+        status, data = self.post([
+            {'id': ingredient.id, 'amount': 1},
+            {'id': ingredient.id, 'amount': 2},
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual(data['non_field_errors'], [
+            f'<{ingredient.name}> повторяется в рецепте'
+        ])
+
+    def test_unknown_tags_are_reported_together(self):
+        status, data = self.post(
+            [{'id': self.ingredients[0].id, 'amount': 1}],
+            tags=[self.tags[0].id, 998, 'x', 999]
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            data['non_field_errors'], ['некорректные тэги 998, x, 999']
+        )
+
+    def test_all_ingredient_errors_are_reported_together(self):
+        first, second, _ = self.ingredients
+        status, data = self.post([
+            {'id': 999, 'amount': 1},
+            {'id': first.id, 'amount': 1},
+            {'id': first.id, 'amount': 1},
+            {'id': second.id, 'amount': 0},
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual(len(data['non_field_errors']), 3)
+
+    def test_validation_query_count_does_not_grow(self):
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {number}', measurement_unit='г'
+            )
+            for number in range(100)
+        ]
+        self.post([{'id': self.ingredients[0].id, 'amount': 1}] * 2)
+        for size in (3, 100):
+            payload = [
+                {'id': ingredient.id, 'amount': 1}
+                for ingredient in ingredients[:size]
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                status, _ = self.post(payload + payload[:1])
+            self.assertEqual(status, 400)
+            self.assertEqual(len(queries), 4)
+
+
+class CookIndexTest(FoodgramTestCase):
+    def test_update_leaves_old_index_intact(self):
+        index = CookIndex.build([(1, 10), (1, 11), (2, 10)])
+        updated = index.update((1, 3), [(1, 12), (3, 11)])
+        self.assertEqual(index.recipes, {1: (10, 11), 2: (10,)})
+        self.assertEqual(index.postings, {10: {1, 2}, 11: {1}})
+        self.assertEqual(updated.recipes, {1: (12,), 2: (10,), 3: (11,)})
+        self.assertEqual(updated.postings[11], {3})
+        self.assertEqual(list(index.rank({10, 11})[:5]), [
+            (1.0, 0, 2), (1.0, 0, 1)
+        ])
+        self.assertEqual(list(updated.rank({10, 11})[:5]), [
+            (1.0, 0, 3), (1.0, 0, 2)
+        ])
+
+    def test_ranking_pages(self):
+        links = [
+            (recipe, ingredient)
+            for recipe in range(1, 31)
+            for ingredient in range(recipe % 4 + 1)
+        ]
+        ranking = CookIndex.build(links).rank({0, 1})
+        expected = [
+            (min(total, 2) / total, total - min(total, 2), recipe)
+            for recipe, total in (
+                (recipe, recipe % 4 + 1) for recipe in range(1, 31)
+            )
+        ]
+        expected.sort(key=lambda item: (-item[0], item[1], -item[2]))
+        self.assertEqual(len(ranking), 30)
+        self.assertEqual(ranking[0:30], expected)
+        self.assertEqual(ranking[6:12], expected[6:12])
+
+    def cook(self):
+        response = self.anonymous.get('/api/recipes/cook/?' + '&'.join(
+            f'ingredients={ingredient.id}'
+            for ingredient in self.ingredients[:2]
+        ))
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe['id'], recipe['missing_count'],
+             round(recipe['coverage'], 2))
+            for recipe in response.json()['results']
+        ]
+
+    def test_endpoint_builds_index_in_background(self):
+        expected = [
+            (recipe.id, 1, 0.67) for recipe in reversed(self.recipes)
+        ]
+        with self.assertNumQueries(6):
+            self.assertEqual(self.cook(), expected)
+        (run, *args), _ = self.executor.submit.call_args
+        self.assertIs(run, catalogue.run_refresh)
+        catalogue.refresh_local(*args)
+        self.assertIsInstance(search.get_cook_index(), CookIndex)
+        with self.assertNumQueries(3):
+            self.assertEqual(self.cook(), expected)
+        self.assertEqual(self.executor.submit.call_count, 1)
+
+    def test_stale_index_is_served_while_refreshing(self):
+        catalogue.refresh_local(
+            ('recipes', 'cook'), catalogue.get_version('recipes'),
+            lambda: CookIndex.build([]), None
+        )
+        with run_on_commit():
+            catalogue.bump('recipes', (self.recipes[0].pk,))
+        self.assertEqual(self.cook(), [])
+        self.assertEqual(self.cook(), [])
+        self.assertEqual(self.executor.submit.call_count, 1)
+
+
+class CatalogueChangesTest(FoodgramTestCase):
+    def bump(self, name, changed=None):
+        with run_on_commit():
+            catalogue.bump(name, changed)
+
+    def test_changes_of_every_bump_are_kept(self):
+        since = catalogue.get_version('test')
+        self.bump('test', (1,))
+        self.bump('test', (2, 3))
+        version = catalogue.get_version('test')
+        self.assertEqual(version, since + 2)
+        self.assertEqual(
+            catalogue.get_changes('test', since, version), {1, 2, 3}
+        )
+
+    def test_gaps_force_rebuild(self):
+        since = catalogue.get_version('test')
+        self.bump('test', (1,))
+        self.bump('test')
+        version = catalogue.get_version('test')
+        self.assertIsNone(catalogue.get_changes('test', since, version))
+        self.assertIsNone(catalogue.get_changes('test', version, since))
+
+    @override_settings(CATALOGUE_MAX_CHANGES=2)
+    def test_old_changes_are_pruned(self):
+        since = catalogue.get_version('test')
+        for pk in range(4):
+            self.bump('test', (pk,))
+        version = catalogue.get_version('test')
+        self.assertEqual(CatalogueChange.objects.count(), 2)
+        self.assertIsNone(catalogue.get_changes('test', since, version))
+        self.assertEqual(
+            catalogue.get_changes('test', version - 1, version), {3}
+        )
+
+    def test_changes_do_not_depend_on_cache_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                since = catalogue.get_version('test')
+                self.bump('test', (1,))
+                version = catalogue.get_version('test')
+                self.assertEqual(version, since + 1)
+                self.assertEqual(
+                    catalogue.get_changes('test', since, version), {1}
+                )
+
+    def test_local_objects_are_patched(self):
+        built = []
+
+        def build():
+            built.append(True)
+            return frozenset()
+
+        def update(value, changed):
+            return value | changed
+
+        catalogue.get_local('test', 'set', build, update)
+        self.bump('test', (5,))
+        self.bump('test', (6,))
+        self.assertEqual(
+            catalogue.get_local('test', 'set', build, update), {5, 6}
+        )
+        self.assertEqual(len(built), 1)
+
+    def test_expired_version_is_not_a_change(self):
+        built = []
+
+        def build():
+            built.append(True)
+            return frozenset()
+
+        self.bump('test', (1,))
+        catalogue.get_local('test', 'set', build)
+        version = catalogue.get_version('test')
+        cache.clear()
+        self.assertEqual(catalogue.get_version('test'), version)
+        catalogue.get_local('test', 'set', build)
+        self.assertEqual(len(built), 1)
+
+    def test_catalogue_etag(self):
+        first = self.anonymous.get('/api/tags/')
+        self.assertEqual(first.status_code, 200)
+        cache.clear()
+        response = self.anonymous.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+        with run_on_commit():
+            Tag.objects.create(name='Новый', color='#000009', slug='new')
+        response = self.anonymous.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+
+class ImageStorageTest(FoodgramTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = ContentAddressedStorage()
+
+    def test_same_content_same_name(self):
+        first = self.storage.save('images/a.PNG', ContentFile(b'data'))
+        second = self.storage.save('images/b.png', ContentFile(b'data'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith('.png'))
+
+    def test_restore_after_concurrent_delete(self):
+        name = self.storage.save('images/a.jpg', ContentFile(b'data'))
+        self.storage.delete(name)
+        self.storage.restore(name, b'data')
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b'data')
+
+    def test_discard_keeps_file_used_meanwhile(self):
+        name = self.storage.save('images/a.jpg', ContentFile(b'data'))
+        self.assertFalse(self.storage.discard(name, lambda: True))
+        self.assertTrue(self.storage.exists(name))
+        self.assertTrue(self.storage.discard(name, lambda: False))
+        self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.discard(name, lambda: False))
+
+    def test_used_image_is_kept(self):
+        name = Recipe._meta.get_field('image').storage.save(
+            'images/a.jpg', ContentFile(b'data')
+        )
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(image=name)
+        delete_unused_image(name)
+        self.assertTrue(Recipe._meta.get_field('image').storage.exists(name))
+
+    def post_image(self, image):
+        return self.client.post('/api/recipes/', {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image,
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+        }, format='json')
+
+    def test_upload_is_compressed_in_background(self):
+        response = self.post_image(image_payload((2400, 60)))
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(pk=response.json()['id'])
+        original = recipe.image.name
+        self.assertTrue(original.endswith('.png'))
+        self.assertFalse(recipe.renditions_ready)
+        make_renditions(recipe.pk, original, optimize=True)
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.renditions_ready)
+        self.assertTrue(recipe.image.name.endswith('.jpg'))
+        storage = Recipe._meta.get_field('image').storage
+        self.assertFalse(storage.exists(original))
+        with storage.open(recipe.image.name) as file:
+            self.assertEqual(Image.open(file).size, (1920, 48))
+        for path in rendition_names(recipe.image.name).values():
+            self.assertTrue(storage.exists(path))
+
+    def test_replaced_upload_is_not_restored(self):
+        response = self.post_image(image_payload())
+        recipe = Recipe.objects.get(pk=response.json()['id'])
+        original = recipe.image.name
+        Recipe.objects.filter(pk=recipe.pk).update(image='images/test.jpg')
+        make_renditions(recipe.pk, original, optimize=True)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image.name, 'images/test.jpg')
+        self.assertFalse(recipe.renditions_ready)
+        self.assertEqual([
+            files for _, _, files in os.walk(settings.MEDIA_ROOT) if files
+        ], [])
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=50)
+    def test_resolution_is_checked_in_request(self):
+        response = self.post_image(image_payload())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['image'], [
+            'Слишком большое разрешение изображения 8x8'
+        ])
+
+    def test_rendition_names_follow_settings(self):
+        names = rendition_names('images/ab/cd.jpg')
+        self.assertNotEqual(names, rendition_names('images/ab/cd.jpg', ''))
+        with override_settings(RECIPE_IMAGE_QUALITY=70):
+            self.assertNotEqual(names, rendition_names('images/ab/cd.jpg'))
+        with override_settings(RECIPE_IMAGE_RENDITIONS_REVISION=2):
+            self.assertNotEqual(names, rendition_names('images/ab/cd.jpg'))
+
+
+class ResponseCacheInvalidationTest(FoodgramTestCase):
+    def version(self):
+        return catalogue.get_version('recipe_responses')
+
+    def test_relation_changes_keep_cached_bodies(self):
+        recipe = self.recipes[1]
+        path = f'/api/recipes/{recipe.id}/'
+        first = self.anonymous.get(path)
+        version = self.version()
+        with run_on_commit():
+            self.author.favorites.add(recipe)
+        self.assertEqual(self.version(), version)
+        response = self.anonymous.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['favorites_count'], 1)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(self.client.get(path).json()['favorites_count'], 1)
+        again = self.anonymous.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_only_author_fields_invalidate(self):
+        version = self.version()
+        with run_on_commit():
+            self.author.set_password('another-password')
+            self.author.save()
+            self.user.first_name = 'Читатель'
+            self.user.save()
+        self.assertEqual(self.version(), version)
+        with run_on_commit():
+            self.author.first_name = 'Автор'
+            self.author.save()
+        self.assertNotEqual(self.version(), version)
+
+    def test_counter_ordering_is_not_cached(self):
+        path = '/api/recipes/?ordering=-favorites_count'
+        self.anonymous.get(path)
+        with CaptureQueriesContext(connection) as queries:
+            self.anonymous.get(path)
+        self.assertTrue(queries)
+
+
+class RelationsCacheTest(FoodgramTestCase):
+    def test_set_read_before_change_is_not_kept(self):
+        recipe = self.recipes[1]
+        load = relations.RELATIONS['favorites']
+
+        def load_then_change(user):
+            ids = list(load(user))
+            with run_on_commit():
+                user.favorites.add(recipe)
+            return ids
+
+        with mock.patch.dict(relations.RELATIONS, favorites=load_then_change):
+            stale = relations.UserRelations(self.user)
+        self.assertNotIn(recipe.pk, stale.favorites)
+        self.assertIn(recipe.pk, relations.UserRelations(self.user).favorites)
+
+    def test_sets_are_cached(self):
+        relations.UserRelations(self.user)
+        with self.assertNumQueries(0):
+            cached = relations.UserRelations(self.user)
+        self.assertEqual(cached.favorites, {self.recipes[0].pk})
+        self.assertEqual(cached.carts, {self.recipes[1].pk})
+        self.assertEqual(cached.subscriptions, {self.author.pk})
+
+
+class TokenCacheTest(FoodgramTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        shared_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location.name,
+        }})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        authentication.local_tokens.clear()
+        self.key = Token.objects.get(user=self.user).key
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_token_is_cached_without_password(self):
+        self.assertEqual(self.me(), 200)
+        data = cache.get(authentication.token_cache_key(self.key))
+        self.assertNotIn(self.user.password, repr(data))
+        authentication.local_tokens.clear()
+        with self.assertNumQueries(0):
+            token = CachedTokenAuthentication().load_token(self.key)
+        self.assertEqual(token.user.email, self.user.email)
+        with self.assertNumQueries(1):
+            self.assertTrue(token.user.check_password('password'))
+
+    def test_rejected_after_logout(self):
+        self.assertEqual(self.me(), 200)
+        with run_on_commit():
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.me(), 401)
+
+    def test_rejected_after_set_password(self):
+        self.assertEqual(self.me(), 200)
+        with run_on_commit():
+            response = self.client.post('/api/users/set_password/', {
+                'new_password': 'another-password-42',
+                'current_password': 'password',
+            }, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.me(), 401)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('another-password-42'))
+
+    def test_rejected_after_deactivation(self):
+        self.assertEqual(self.me(), 200)
+        with run_on_commit():
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.me(), 401)
+
+
+class LocalCacheTimeoutTest(FoodgramTestCase):
+    def expires_in(self, key):
+        return cache._expire_info[cache.make_key(key)] - time.time()
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=7)
+    def test_process_local_entries_expire_quickly(self):
+        self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.anonymous.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.anonymous.get(f'/api/recipes/{self.recipes[0].id}/')
+        for key in (
+            f'relations:{self.user.pk}:favorites:generation',
+            f'counters:{self.recipes[0].id}:generation',
+            'catalogue:recipe_responses:version',
+        ):
+            self.assertLessEqual(self.expires_in(key), 7)
+
+
+class ConnectionHealthCheckTest(TestCase):
+    @override_settings(DB_HEALTH_CHECK_INTERVAL=30)
+    def test_only_idle_connections_are_checked(self):
+        record_db_connections(sender=None)
+        with mock.patch.object(connection, 'is_usable') as is_usable:
+            check_db_connections(sender=None)
+            is_usable.assert_not_called()
+            connection.idle_since -= 31
+            check_db_connections(sender=None)
+            is_usable.assert_called_once_with()
@@ -1,29 +1,173 @@
+import json
+from hashlib import md5
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Prefetch, Sum
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag, urlencode
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from api.filters import IngredientSearchFilter, RecipeFilter
+from api import catalogue, counters, metrics
+from api.filters import (IngredientSearchFilter, RecipeFilter,
+                         RecipeSearchFilter)
+from api.paginators import (CursorPaginationMixin, FeedPagination,
+                            PageNumberLimitPagination,
+                            UsernameCursorPagination)
 from api.permissions import AdminOrReadOnly, OwnerAndAdminOrReadOnly
-from api.serializers import (IngredientSerializer, RecipeLiteSerializer,
-                             RecipeSerializer, TagSerializer, UserSerializer,
+from api.relations import get_relations
+from api.renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                           ShoppingCartPDFRenderer, ShoppingCartTextRenderer)
+from api.search import rank_cook_recipes
+from api.serializers import (IngredientSerializer, RecipeCookSerializer,
+                             RecipeLiteSerializer, RecipeSerializer,
+                             TagSerializer, UserSerializer,
                              UserSubscribeSerializer)
-from recipes.models import Ingredient, Recipe, RecipeIngredientLink, Tag
+from recipes.models import Ingredient, Recipe, Tag
 
 User = get_user_model()
-CONTENT_TYPE_SHOPPING_FILE = 'text/plain'
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+    ShoppingCartPDFRenderer,
+)
+
+
+class CatalogueListMixin:
+    catalogue_name = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        version = catalogue.get_version(self.catalogue_name)
+        etag = quote_etag(str(version))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                catalogue.get_body(
+                    self.catalogue_name, version, self.render_catalogue
+                ),
+                content_type='application/json'
+            )
+        response['ETag'] = etag
+        return response
+
+    def render_catalogue(self):
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return JSONRenderer().render(serializer.data)
+
+
+class AnonymousResponseCacheMixin:
+    response_cache_name = 'recipe_responses'
+    user_specific_params = ('is_favorited', 'is_in_shopping_cart')
+    uncached_ordering = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def is_user_specific(self, request):
+        return request.user.is_authenticated and bool(
+            set(self.user_specific_params) & request.query_params.keys()
+        )
+
+    def get_response_cache_key(self, request):
+        query = urlencode(sorted(
+            (key, sorted(values))
+            for key, values in request.query_params.lists()
+        ), doseq=True)
+        version = catalogue.get_version(self.response_cache_name)
+        uri = request.build_absolute_uri(request.path)
+        return md5(f'{version}:{uri}?{query}'.encode()).hexdigest()
+
+    def render_anonymous(self, handler, request, *args, **kwargs):
+        user = request.user
+        request.user = AnonymousUser()
+        try:
+            response = handler(request, *args, **kwargs)
+        finally:
+            request.user = user
+        return response
+
+    def is_cacheable(self, request):
+        ordering = request.query_params.get('ordering', '')
+        return not {
+            field.strip().lstrip('-') for field in ordering.split(',')
+        } & set(self.uncached_ordering)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        user = request.user
+        if not settings.RESPONSE_CACHE_TIMEOUT or (
+            request.accepted_renderer.format != 'json'
+        ) or self.is_user_specific(request) or not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        body = cache.get(f'responses:{key}')
+        metrics.inc(
+            'foodgram_cache_requests_total',
+            cache='responses', result='miss' if body is None else 'hit'
+        )
+        if body is None:
+            response = self.render_anonymous(
+                handler, request, *args, **kwargs
+            )
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            body = JSONRenderer().render(response.data)
+            cache.set(
+                f'responses:{key}', body, settings.RESPONSE_CACHE_TIMEOUT
+            )
+            data = json.loads(body)
+        else:
+            data = self.overlay_counters(json.loads(body))
+        if user.is_authenticated:
+            return Response(self.overlay(data, user))
+        body = JSONRenderer().render(data)
+        etag = quote_etag(md5(body).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            metrics.inc(
+                'foodgram_cache_requests_total',
+                cache='responses', result='not_modified'
+            )
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def overlay_counters(self, data):
+        return data
+
+    def overlay(self, data, user):
+        return data
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(CursorPaginationMixin, DjoserUserViewSet):
     permission_classes = (IsAuthenticated,)
+    cursor_pagination_class = UsernameCursorPagination
+
+    def is_user_specific(self, request):
+        return self.action == 'subscriptions'
 
     @action(methods=('get', 'post', 'delete'), detail=True)
     def subscribe(self, request, id):
@@ -46,12 +190,25 @@ class UserViewSet(DjoserUserViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    def get_recipes_limit(self):
+        limit = self.request.query_params.get('recipes_limit')
+        if limit is None or not limit.isdigit():
+            return None
+        return int(limit)
+
     @action(methods=('get',), detail=False)
     def subscriptions(self, request):
         user = self.request.user
         if user.is_anonymous:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        authors = user.subscribe.all()
+        authors = user.subscribe.annotate(
+            recipes_count=Count('recipes')
+        ).prefetch_related(Prefetch(
+            'recipes',
+            queryset=Recipe.objects.defer('search_vector').latest_per_author(
+                self.get_recipes_limit()
+            )
+        ))
         pages = self.paginate_queryset(authors)
         serializer = UserSubscribeSerializer(
             pages, many=True, context={'request': request}
@@ -59,28 +216,88 @@ class UserViewSet(DjoserUserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogueListMixin, ReadOnlyModelViewSet):
+    catalogue_name = 'ingredients'
     queryset = Ingredient.objects.all()
     pagination_class = None
     permission_classes = (AdminOrReadOnly,)
     serializer_class = IngredientSerializer
     filter_backends = (IngredientSearchFilter,)
-    search_fields = ('^name',)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CatalogueListMixin, ReadOnlyModelViewSet):
+    catalogue_name = 'tags'
     queryset = Tag.objects.all()
     pagination_class = None
     permission_classes = (AdminOrReadOnly,)
     serializer_class = TagSerializer
 
 
-class RecipeViewSet(ModelViewSet):
-    queryset = Recipe.objects.select_related('author')
+class RecipeViewSet(AnonymousResponseCacheMixin, CursorPaginationMixin,
+                    ModelViewSet):
+    queryset = Recipe.objects.defer('search_vector').select_related('author')
     serializer_class = RecipeSerializer
     permission_classes = (OwnerAndAdminOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, OrderingFilter, RecipeSearchFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date',) + counters.FIELDS
+    ordering = ('-pub_date', '-id')
+    uncached_ordering = counters.FIELDS
+
+    def get_queryset(self):
+        return Recipe.objects.with_related()
+
+    def overlay_counters(self, data):
+        recipes = data.get('results', [data])
+        values = counters.get_counters([recipe['id'] for recipe in recipes])
+        for recipe in recipes:
+            if recipe['id'] in values:
+                recipe.update(zip(counters.FIELDS, values[recipe['id']]))
+        return data
+
+    def overlay(self, data, user):
+        relations = get_relations(self.request)
+        for recipe in data.get('results', [data]):
+            recipe['is_favorited'] = recipe['id'] in relations.favorites
+            recipe['is_in_shopping_cart'] = recipe['id'] in relations.carts
+            recipe['author']['is_subscribed'] = (
+                recipe['author']['id'] in relations.subscriptions
+            )
+        return data
+
+    @action(
+        methods=('get',), detail=False, permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        paginator = FeedPagination()
+        recipes = paginator.paginate_feed(
+            self.get_queryset(), request.user.subscribe.all(), request
+        )
+        serializer = self.get_serializer(recipes, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=('get',), detail=False)
+    def cook(self, request):
+        ingredients = {
+            int(pk) for pk in request.query_params.getlist('ingredients')
+            if pk.isdigit()
+        }
+        paginator = PageNumberLimitPagination()
+        page = paginator.paginate_queryset(
+            rank_cook_recipes(ingredients), request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(pk for _, _, pk in page)
+        results = []
+        for coverage, missing, pk in page:
+            if pk in recipes:
+                recipe = recipes[pk]
+                recipe.coverage = coverage
+                recipe.missing_count = missing
+                results.append(recipe)
+        serializer = RecipeCookSerializer(
+            results, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
 
     def __add_del_m2m(self, pk, m2m) -> Response:
         user = self.request.user
@@ -110,24 +327,54 @@ class RecipeViewSet(ModelViewSet):
     def shopping_cart(self, request, pk):
         return self.__add_del_m2m(pk, self.request.user.carts)
 
-    @action(methods=('get',), detail=False)
+    def get_shopping_cart_state(self, items, renderer):
+        state = items.aggregate(
+            count=Count('id'), ids=Sum('id'), last=Max('id'),
+            amount=Sum('amount'), modified=Max('modified')
+        )
+        fingerprint = f'{self.request.user}:{renderer.format}:{state}'
+        modified = state['modified'] and int(state['modified'].timestamp())
+        return quote_etag(md5(fingerprint.encode()).hexdigest()), modified
+
+    @action(
+        methods=('get',), detail=False,
+        renderer_classes=SHOPPING_CART_RENDERERS
+    )
     def download_shopping_cart(self, request):
         user = self.request.user
         if user.is_anonymous:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        ingredients = RecipeIngredientLink.objects.filter(
-            recipe__in=(user.carts.values('id'))
-        ).values(
-            ing=F('ingredients__name'),
-            unit=F('ingredients__measurement_unit')
-        ).annotate(cnt=Sum('amount')).order_by()
-
-        rows = [f'{i["ing"]} ({i["unit"]}) - {i["cnt"]}' for i in ingredients]
-        shopping_text = f'Список покупок {str(user)}\n\n' + '\n'.join(rows)
-
-        response = HttpResponse(shopping_text,
-                                content_type=CONTENT_TYPE_SHOPPING_FILE)
+        items = user.shopping_cart_items.all()
+        renderer = request.accepted_renderer
+        etag, modified = self.get_shopping_cart_state(items, renderer)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=modified
+        )
+        if response is not None:
+            return response
+
+        ingredients = items.values(
+            ing=F('ingredient__name'),
+            unit=F('ingredient__measurement_unit'),
+            cnt=F('amount')
+        ).order_by('ing', 'unit')
+
+        response = StreamingHttpResponse(
+            metrics.observe_stream(
+                renderer.stream(user, ingredients.iterator(
+                    chunk_size=settings.SHOPPING_CHUNK_SIZE
+                )),
+                'foodgram_shopping_cart_download_bytes',
+                format=renderer.format
+            ),
+            content_type=renderer.media_type if renderer.charset is None
+            else f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
         response['Content-Disposition'] = (
-            f'attachment; filename={settings.SHOPPING_FILE}'
+            'attachment; '
+            f'filename={settings.SHOPPING_FILE_NAME}.{renderer.format}'
         )
         return response
@@ -0,0 +1,124 @@
+import os
+import threading
+from functools import partial
+from time import monotonic
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2 import Error as PsycopgError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from api import metrics
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, alias, max_size=10, timeout=5, check_interval=30):
+        self.alias = alias
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.in_use = 0
+
+    def record(self):
+        for state, value in (('idle', len(self.idle)),
+                             ('in_use', self.in_use)):
+            metrics.registry.set(
+                'foodgram_db_pool_connections',
+                {'alias': self.alias, 'state': state}, value
+            )
+
+    def is_alive(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except PsycopgError:
+            return False
+        return True
+
+    def take_idle(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                connection, released = self.idle.pop()
+            if connection.closed:
+                continue
+            if (monotonic() - released < self.check_interval
+                    or self.is_alive(connection)):
+                return connection
+            connection.close()
+
+    def acquire(self, connect):
+        start = monotonic()
+        if not self.slots.acquire(timeout=self.timeout):
+            metrics.inc('foodgram_db_pool_timeouts_total', alias=self.alias)
+            raise OperationalError(
+                f'Нет свободного соединения в пуле {self.alias} '
+                f'за {self.timeout} с'
+            )
+        metrics.registry.observe(
+            'foodgram_db_pool_wait_seconds', {'alias': self.alias},
+            monotonic() - start, metrics.LATENCY_BUCKETS
+        )
+        try:
+            connection = self.take_idle() or connect()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.in_use += 1
+            self.record()
+        return connection
+
+    def release(self, connection):
+        try:
+            if not connection.closed:
+                if connection.get_transaction_status() != (
+                    TRANSACTION_STATUS_IDLE
+                ):
+                    connection.rollback()
+                with self.lock:
+                    self.idle.append((connection, monotonic()))
+        except PsycopgError:
+            connection.close()
+        finally:
+            with self.lock:
+                self.in_use -= 1
+                self.record()
+            self.slots.release()
+
+
+def get_pool(alias, options):
+    key = (os.getpid(), alias)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(
+                alias,
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 5),
+                check_interval=options.get('CHECK_INTERVAL', 30)
+            )
+        return pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire(
+            partial(super().get_new_connection, conn_params)
+        )
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 import os
+import tempfile
 
 # from dotenv import load_dotenv
 from decouple import Csv, config
@@ -25,7 +26,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = config('SECRET_KEY', default='super_secret_key')
 # SECURITY WARNING: don't run with debug turned on in production!
 
-DEBUG = config('DEBUG', default=True, cast=bool)
+DEBUG = config('DEBUG', default=False, cast=bool)
 
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='*', cast=Csv())
 
@@ -50,9 +51,12 @@ INSTALLED_APPS = [
     'django_filters',
     'users.apps.UsersConfig',
     'recipes.apps.RecipeConfig',
+    'api.apps.ApiConfig',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,17 +90,79 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+
 DATABASES = {
     'default': {
-        'ENGINE': config('DB_ENGINE', default='django.db.backends.postgresql'),
+        'ENGINE': 'foodgram.db.postgresql_pool' if DB_POOL else config(
+            'DB_ENGINE', default='django.db.backends.postgresql'
+        ),
         'NAME': config('POSTGRES_DB', default='foodgram'),
         'USER': config('POSTGRES_USER', default='foodgram_user'),
         'PASSWORD': config('POSTGRES_PASSWORD', default='foodgram_user'),
         'HOST': config('DB_HOST', default='localhost'),
-        'PORT': config('DB_PORT', default=5432, cast=int)
+        'PORT': config('DB_PORT', default=5432, cast=int),
+        'CONN_MAX_AGE': 0 if DB_POOL else config(
+            'DB_CONN_MAX_AGE', default=60, cast=int
+        ),
+        'POOL': {
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=5, cast=float),
+            'CHECK_INTERVAL': config(
+                'DB_POOL_CHECK_INTERVAL', default=30, cast=float
+            ),
+        },
+    }
+}
+DB_HEALTH_CHECKS = config('DB_HEALTH_CHECKS', default=True, cast=bool)
+DB_HEALTH_CHECK_INTERVAL = config(
+    'DB_HEALTH_CHECK_INTERVAL', default=30, cast=float
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default='foodgram'),
     }
 }
 
+LOCAL_CACHE_TIMEOUT = config('LOCAL_CACHE_TIMEOUT', default=10, cast=int)
+CATALOGUE_CACHE_TIMEOUT = config(
+    'CATALOGUE_CACHE_TIMEOUT', default=24 * 60 * 60, cast=int
+)
+CATALOGUE_VERSION_TIMEOUT = config(
+    'CATALOGUE_VERSION_TIMEOUT', default=60, cast=int
+)
+METRICS_DIR = config(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram_metrics')
+)
+METRICS_FLUSH_INTERVAL = 1
+INSTRUMENTATION_SAMPLE_RATE = config(
+    'INSTRUMENTATION_SAMPLE_RATE', default=0.0, cast=float
+)
+AUTH_TOKEN_CACHE_SIZE = config(
+    'AUTH_TOKEN_CACHE_SIZE', default=10000, cast=int
+)
+AUTH_TOKEN_CACHE_TIMEOUT = config(
+    'AUTH_TOKEN_CACHE_TIMEOUT', default=5 * 60, cast=int
+)
+AUTH_TOKEN_LOCAL_TTL = config('AUTH_TOKEN_LOCAL_TTL', default=5, cast=int)
+RESPONSE_CACHE_TIMEOUT = config(
+    'RESPONSE_CACHE_TIMEOUT', default=10 * 60, cast=int
+)
+RELATIONS_CACHE_TIMEOUT = config(
+    'RELATIONS_CACHE_TIMEOUT', default=24 * 60 * 60, cast=int
+)
+CATALOGUE_MAX_CHANGES = config('CATALOGUE_MAX_CHANGES', default=1000, cast=int)
+
+INGREDIENT_SEARCH_INDEX = config(
+    'INGREDIENT_SEARCH_INDEX', default=True, cast=bool
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -118,7 +184,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES':
-    ['rest_framework.authentication.TokenAuthentication', ],
+    ['api.authentication.CachedTokenAuthentication', ],
 
     'DEFAULT_PERMISSION_CLASSES':
     ['rest_framework.permissions.IsAuthenticatedOrReadOnly', ],
@@ -127,9 +193,18 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+PAGINATION_COUNT_CACHE_TIMEOUT = config(
+    'PAGINATION_COUNT_CACHE_TIMEOUT', default=30, cast=int
+)
+PAGINATION_APPROXIMATE_COUNT = config(
+    'PAGINATION_APPROXIMATE_COUNT', default=100000, cast=int
+)
+FEED_MERGE_MAX_AUTHORS = config('FEED_MERGE_MAX_AUTHORS', default=50, cast=int)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
+    'LOGOUT_ON_PASSWORD_CHANGE': True,
     'SERIALIZERS': {
         'user': 'api.serializers.UserSerializer',
         'user_list': 'api.serializers.UserSerializer',
@@ -161,4 +236,35 @@ AUTH_USER_MODEL = 'users.User'
 
 RECIPE_MIN_COOKING_TIME = 1
 RECIPE_MIN_AMOUNT = 1
-SHOPPING_FILE = 'list.txt'
+SHOPPING_FILE_NAME = 'list'
+SHOPPING_CHUNK_SIZE = 2000
+SHOPPING_PDF_FONT = config(
+    'SHOPPING_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+RECIPE_IMAGE_MAX_SIZE = config(
+    'RECIPE_IMAGE_MAX_SIZE', default=5 * 1024 * 1024, cast=int
+)
+RECIPE_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+RECIPE_IMAGE_MAX_SIDE = 1920
+RECIPE_IMAGE_QUALITY = 85
+RECIPE_IMAGE_RENDITIONS = {'small': 320, 'medium': 640}
+# Увеличить при смене кодировщика, чтобы миниатюры получили новые имена:
+# nginx отдаёт их как immutable.
+RECIPE_IMAGE_RENDITIONS_REVISION = 1
+RECIPE_IMAGE_WORKERS = config('RECIPE_IMAGE_WORKERS', default=2, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.instrumentation': {
+            'handlers': ('console',),
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib.admin import register
 
-from recipes.models import Ingredient, Recipe, RecipeIngredientLink, Tag
+from recipes.models import (Ingredient, Recipe, RecipeIngredientLink,
+                            ShoppingCartItem, Tag)
 
 
 class RecipeInlineTags(admin.TabularInline):
@@ -33,6 +34,13 @@ class IngredientAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
     inlines = (RecipeInlineIngredients,)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        ShoppingCartItem.objects.refresh(ingredients=(form.instance.pk,))
+        Recipe.objects.filter(
+            ingredients=form.instance
+        ).refresh_search_vectors()
+
 
 @register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -53,8 +61,22 @@ class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
     inlines = (InlineIngredientsInRecipe,)
 
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            obj.renditions_ready = False
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        ShoppingCartItem.objects.refresh(
+            users=form.instance.cart.values('id')
+        )
+        Recipe.objects.filter(pk=form.instance.pk).refresh_search_vectors()
+
     def count_favorites(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
+    count_favorites.admin_order_field = 'favorites_count'
+    count_favorites.short_description = 'В избранном'
 
 
 @register(RecipeIngredientLink)
@@ -0,0 +1,173 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+renditions_ready = Signal()
+executor = ThreadPoolExecutor(max_workers=settings.RECIPE_IMAGE_WORKERS)
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def encode(image, side):
+    image = image.copy()
+    image.thumbnail((side, side), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(
+        buffer, 'JPEG', quality=settings.RECIPE_IMAGE_QUALITY,
+        optimize=True, progressive=True
+    )
+    return buffer.getvalue()
+
+
+def to_rgb(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def open_image(file):
+    # Pillow читает только заголовок, поэтому разрешение проверяется
+    # до распаковки изображения.
+    file.seek(0)
+    image = Image.open(file)
+    width, height = image.size
+    if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f'{width}x{height}')
+    return image
+
+
+def compress(file):
+    return ContentFile(
+        encode(to_rgb(open_image(file)), settings.RECIPE_IMAGE_MAX_SIDE),
+        name=f'{uuid4().hex}.jpg'
+    )
+
+
+def renditions_version():
+    options = (
+        settings.RECIPE_IMAGE_RENDITIONS_REVISION,
+        settings.RECIPE_IMAGE_QUALITY,
+        sorted(settings.RECIPE_IMAGE_RENDITIONS.items()),
+    )
+    return sha256(repr(options).encode()).hexdigest()[:8]
+
+
+def rendition_names(name, version=None):
+    if version is None:
+        version = renditions_version()
+    stem = os.path.splitext(os.path.basename(name))[0]
+    suffix = f'_{version}' if version else ''
+    return {
+        rendition: f'images/renditions/{stem}_{rendition}_{side}{suffix}.jpg'
+        for rendition, side in settings.RECIPE_IMAGE_RENDITIONS.items()
+    }
+
+
+def rendition_urls(recipe):
+    if not recipe.image or not recipe.renditions_ready:
+        return None
+    return {
+        rendition: default_storage.url(path)
+        for rendition, path in rendition_names(
+            recipe.image.name, recipe.renditions_version
+        ).items()
+    }
+
+
+def save_renditions(name, version=None):
+    from recipes.models import Recipe
+
+    paths = {
+        rendition: path
+        for rendition, path in rendition_names(name, version).items()
+        if not default_storage.exists(path)
+    }
+    if not paths:
+        return
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(name) as file:
+        image = to_rgb(Image.open(file))
+    for rendition, path in paths.items():
+        default_storage.save(path, ContentFile(
+            encode(image, settings.RECIPE_IMAGE_RENDITIONS[rendition])
+        ))
+
+
+def save_compressed(name):
+    from recipes.models import Recipe
+
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(name) as file:
+        content = compress(file)
+    return storage.save(f'images/{content.name}', content)
+
+
+def make_renditions(recipe_id, name, optimize=False):
+    from recipes.models import Recipe
+
+    image = save_compressed(name) if optimize else name
+    version = renditions_version()
+    save_renditions(image, version)
+    # Сжатое фото подменяет загруженное вместе с миниатюрами, если рецепт
+    # за это время не получил другое фото.
+    if Recipe.objects.filter(pk=recipe_id, image=name).exclude(
+        image=image, renditions_ready=True, renditions_version=version
+    ).update(image=image, renditions_ready=True, renditions_version=version):
+        renditions_ready.send(sender=Recipe, recipe_id=recipe_id)
+    if image != name:
+        delete_unused_image(name)
+        delete_unused_image(image)
+
+
+def delete_unused_image(name):
+    from recipes.models import Recipe
+
+    def is_used():
+        return Recipe.objects.filter(image=name).exists()
+
+    if is_used():
+        return
+    for version in (renditions_version(), ''):
+        for path in rendition_names(name, version).values():
+            default_storage.delete(path)
+    storage = Recipe._meta.get_field('image').storage
+    if not storage.discard(name, is_used):
+        save_renditions(name)
+
+
+def release_image(name):
+    if name:
+        transaction.on_commit(lambda: delete_unused_image(name))
+
+
+def run_renditions(recipe_id, name):
+    try:
+        make_renditions(recipe_id, name, optimize=True)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры %s', name)
+    finally:
+        connection.close()
+
+
+def schedule_renditions(recipe):
+    recipe_id, name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(run_renditions, recipe_id, name)
+    )
@@ -1,33 +1,95 @@
+import csv
 import json
+import os
+from itertools import islice
 
-from django.core.management.base import BaseCommand
-from django.db.utils import IntegrityError
+from django.core.management.base import BaseCommand, CommandError
 
 from recipes.models import Ingredient
+from recipes.signals import ingredients_imported
+
+CHUNK_SIZE = 64 * 1024
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip(' \t\r\n[,')
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break
+            yield item['name'], item['measurement_unit']
+            buffer = buffer[end:]
+    if buffer.strip(' \t\r\n]'):
+        raise CommandError(f'Некорректный JSON: {buffer[:50]}')
+
+
+def read_csv(file):
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2 or not row[0].strip() or not row[1].strip():
+            raise CommandError(
+                f'Некорректная строка {reader.line_num}: {",".join(row)}'
+            )
+        yield row[0], row[1]
 
 
 class Command(BaseCommand):
     help = 'Загрузка ингредиентов'
-    ingfilename = 'ingredients.json'
+    readers = {'.json': read_json, '.csv': read_csv}
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default='ingredients.json',
+            help='Файл с ингредиентами в формате JSON или CSV'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество ингредиентов в одном запросе'
+        )
+
+    def load_batch(self, batch):
+        batch = set(batch)
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('name', 'measurement_unit'))
+        new = batch - existing
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in new),
+            ignore_conflicts=True
+        )
+        return len(new)
 
     def handle(self, *args, **options):
-        try:
-            n_load = 0
-            with open(self.ingfilename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for item in data:
-                    try:
-                        Ingredient.objects.create(name=item["name"],
-                                                  measurement_unit=item[
-                                                      "measurement_unit"])
-                        n_load += 1
-                    except IntegrityError:
-                        print(f'Ингридиет {item["name"]} '
-                              f'{item["measurement_unit"]} '
-                              f'уже есть в базе')
-            print(
-                f'Из файла {self.ingfilename} загружено {n_load} ингредиентов'
-            )
+        path = options['path']
+        reader = self.readers.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError(f'Неизвестный формат файла {path}')
 
+        total = inserted = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                rows = reader(f)
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    total += len(batch)
+                    inserted += self.load_batch(batch)
         except FileNotFoundError:
-            print(f'{self.ingfilename} not found.')
+            raise CommandError(f'{path} not found.')
+        finally:
+            if inserted:
+                ingredients_imported.send(sender=Ingredient)
+
+        self.stdout.write(
+            f'Из файла {path} загружено {inserted} ингредиентов, '
+            f'пропущено {total - inserted}'
+        )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from recipes.images import make_renditions, renditions_version
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создание миниатюр для фото рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только найти рецепты без миниатюр'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help=(
+                'Проверить все рецепты и создать недостающие миниатюры; '
+                'готовые файлы не перезаписываются, для новых миниатюр '
+                'увеличьте RECIPE_IMAGE_RENDITIONS_REVISION'
+            )
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(
+                Q(renditions_ready=False)
+                | ~Q(renditions_version=renditions_version())
+            )
+        pending = list(recipes.values_list('id', 'image', 'renditions_ready'))
+        if options['check']:
+            if pending:
+                raise CommandError(f'Рецептов без миниатюр: {len(pending)}')
+            self.stdout.write('Миниатюры есть у всех рецептов')
+            return
+        failed = 0
+        for recipe, image, ready in pending:
+            try:
+                make_renditions(recipe, image, optimize=not ready)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe}: {error}')
+        self.stdout.write(f'Обработано рецептов: {len(pending) - failed}')
+        if failed:
+            raise CommandError(f'Не удалось обработать: {failed}')
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков избранного и списков покупок у рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только найти рецепты с расхождениями'
+        )
+
+    def handle(self, *args, **options):
+        drift = list(Recipe.objects.annotate(
+            actual_favorites=Count('favorite', distinct=True),
+            actual_carts=Count('cart', distinct=True)
+        ).exclude(
+            favorites_count=F('actual_favorites'),
+            carts_count=F('actual_carts')
+        ).values_list(
+            'id', 'favorites_count', 'actual_favorites',
+            'carts_count', 'actual_carts'
+        ))
+        for recipe, favorites, actual_favorites, carts, actual_carts in drift:
+            self.stdout.write(
+                f'Рецепт {recipe}: избранное {favorites} вместо '
+                f'{actual_favorites}, списки покупок {carts} вместо '
+                f'{actual_carts}'
+            )
+        if options['check'] and drift:
+            raise CommandError(f'Расхождений: {len(drift)}')
+        if drift:
+            Recipe.objects.filter(
+                pk__in=[row[0] for row in drift]
+            ).refresh_counters()
+        self.stdout.write(f'Исправлено рецептов: {len(drift)}'
+                          if drift else 'Расхождений нет')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт сводных списков покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сверить списки покупок с рецептами в корзинах'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            items = ShoppingCartItem.objects.refresh()
+            self.stdout.write(f'Пересчитано {len(items)} позиций')
+            return
+
+        stored = {
+            (item['user'], item['ingredient']): item['amount']
+            for item in ShoppingCartItem.objects.values(
+                'user', 'ingredient', 'amount'
+            ).iterator()
+        }
+        live = {
+            (row['user'], row['ingredients']): row['total']
+            for row in ShoppingCartItem.objects.live().iterator()
+        }
+        drift = sorted(
+            key for key in stored.keys() | live.keys()
+            if stored.get(key) != live.get(key)
+        )
+        for user, ingredient in drift:
+            self.stdout.write(
+                f'Пользователь {user}, ингредиент {ingredient}: '
+                f'{stored.get((user, ingredient))} вместо '
+                f'{live.get((user, ingredient))}'
+            )
+        if drift:
+            raise CommandError(f'Расхождений: {len(drift)}')
+        self.stdout.write(f'Расхождений нет, позиций {len(stored)}')
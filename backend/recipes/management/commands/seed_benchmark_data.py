@@ -0,0 +1,177 @@
+import random
+from io import BytesIO
+from itertools import cycle
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes.images import renditions_version, save_renditions
+from recipes.models import (Ingredient, Recipe, RecipeIngredientLink,
+                            ShoppingCartItem, Tag)
+from recipes.signals import ingredients_imported, recipes_imported
+
+User = get_user_model()
+PREFIX = 'bench_'
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Создание синтетических данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--ingredients', type=int, default=8,
+            help='Среднее число ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Число избранных рецептов у пользователя'
+        )
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Число рецептов в списке покупок у пользователя'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Число подписок у пользователя'
+        )
+        parser.add_argument(
+            '--catalogue', type=int, default=0,
+            help='Дополнить каталог ингредиентов до указанного размера'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить ранее созданные синтетические данные'
+        )
+
+    def save_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), (230, 160, 60)).save(buffer, 'JPEG')
+        name = Recipe._meta.get_field('image').storage.save(
+            'images/benchmark.jpg', ContentFile(buffer.getvalue())
+        )
+        save_renditions(name)
+        return name
+
+    def fill_catalogue(self, options):
+        existing = list(Ingredient.objects.values_list(
+            'name', 'measurement_unit'
+        ))
+        missing = options['catalogue'] - len(existing)
+        if missing <= 0:
+            return
+        Ingredient.objects.bulk_create(
+            (Ingredient(
+                name=f'{name[:150]} {PREFIX}{number}',
+                measurement_unit=unit
+            ) for number, (name, unit) in zip(
+                range(missing), cycle(existing)
+            )),
+            batch_size=options['batch_size']
+        )
+        ingredients_imported.send(sender=Ingredient)
+
+    def create_users(self, options):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (User(
+                username=f'{PREFIX}{number}',
+                email=f'{PREFIX}{number}@example.com',
+                first_name='Тест',
+                last_name=str(number),
+                password=password
+            ) for number in range(options['users'])),
+            batch_size=options['batch_size']
+        )
+        return list(User.objects.filter(
+            username__startswith=PREFIX
+        ).values_list('id', flat=True))
+
+    def create_recipes(self, rng, users, options):
+        image = self.save_image()
+        Recipe.objects.bulk_create(
+            (Recipe(
+                name=f'Рецепт {number}',
+                author_id=rng.choice(users),
+                image=image,
+                renditions_ready=True,
+                renditions_version=renditions_version(),
+                text=f'Описание рецепта {number}',
+                cooking_time=rng.randint(1, 180)
+            ) for number in range(options['recipes'])),
+            batch_size=options['batch_size']
+        )
+        return list(Recipe.objects.filter(
+            author__in=users
+        ).values_list('id', flat=True))
+
+    def link(self, through, rows, options):
+        through.objects.bulk_create(
+            (through(**row) for row in rows),
+            batch_size=options['batch_size'], ignore_conflicts=True
+        )
+
+    def sample(self, rng, population, count):
+        return rng.sample(population, min(count, len(population)))
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        tags = list(Tag.objects.values_list('id', flat=True))
+        if not ingredients or not tags:
+            raise CommandError('Сначала загрузите ингредиенты и создайте теги')
+        bench_users = User.objects.filter(username__startswith=PREFIX)
+        if options['clear']:
+            bench_users.delete()
+            Ingredient.objects.filter(name__contains=f' {PREFIX}').delete()
+        elif bench_users.exists():
+            raise CommandError('Данные уже созданы, используйте --clear')
+
+        with transaction.atomic():
+            self.fill_catalogue(options)
+            users = self.create_users(options)
+            recipes = self.create_recipes(rng, users, options)
+            size = options['ingredients']
+            self.link(RecipeIngredientLink, (
+                {'recipe_id': recipe, 'ingredients_id': ingredient,
+                 'amount': rng.randint(1, 500)}
+                for recipe in recipes
+                for ingredient in self.sample(
+                    rng, ingredients, rng.randint(1, 2 * size - 1)
+                )
+            ), options)
+            self.link(Recipe.tags.through, (
+                {'recipe_id': recipe, 'tag_id': tag}
+                for recipe in recipes
+                for tag in self.sample(rng, tags, rng.randint(1, 2))
+            ), options)
+            for through, count in ((Recipe.favorite.through, 'favorites'),
+                                   (Recipe.cart.through, 'carts')):
+                self.link(through, (
+                    {'user_id': user, 'recipe_id': recipe}
+                    for user in users
+                    for recipe in self.sample(rng, recipes, options[count])
+                ), options)
+            self.link(User.subscribe.through, (
+                {'from_user_id': user, 'to_user_id': author}
+                for user in users
+                for author in self.sample(rng, users, options['subscriptions'])
+                if author != user
+            ), options)
+            new_recipes = Recipe.objects.filter(author__in=users)
+            new_recipes.refresh_counters()
+            new_recipes.refresh_search_vectors()
+            ShoppingCartItem.objects.refresh(users=users)
+            recipes_imported.send(sender=Recipe)
+        self.stdout.write(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)}. '
+            f'Пароль пользователей: {PASSWORD}'
+        )
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+CREATE_INDEX = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_search_name_trgm '
+    'ON recipes_ingredient USING gin '
+    "((REPLACE(LOWER(name), 'ё', 'е')) gin_trgm_ops)",
+)
+DROP_INDEX = ('DROP INDEX IF EXISTS recipes_ingredient_search_name_trgm',)
+
+
+def run_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_shoppingcartitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_postgresql(CREATE_INDEX), run_postgresql(DROP_INDEX)
+        ),
+    ]
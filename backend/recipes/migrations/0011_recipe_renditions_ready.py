@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='renditions_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Миниатюры готовы'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='renditions_version',
+            field=models.CharField(blank=True, editable=False, max_length=16, verbose_name='Версия миниатюр'),
+        ),
+    ]
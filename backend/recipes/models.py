@@ -1,9 +1,21 @@
+import re
+from heapq import merge
+from itertools import islice
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+from recipes.storage import ContentAddressedStorage
 
 User = get_user_model()
+SEARCH_CONFIG = 'russian'
+SEARCH_TOKEN_RE = re.compile(r'\w+')
 
 
 class Ingredient(models.Model):
@@ -46,6 +58,106 @@ class Tag(models.Model):
         return f'{self.name}, {self.color}'
 
 
+def count_links(through):
+    return models.functions.Coalesce(
+        models.Subquery(
+            through.objects.filter(
+                recipe=models.OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                count=models.Count('pk')
+            ).values('count'),
+            output_field=models.PositiveIntegerField()
+        ),
+        0
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredient',
+                queryset=RecipeIngredientLink.objects.select_related(
+                    'ingredients'
+                ).order_by('ingredients__name')
+            ),
+        )
+
+    def latest_per_author(self, limit=None):
+        if limit is None:
+            return self
+        return self.filter(pk__in=models.Subquery(
+            Recipe.objects.filter(
+                author=models.OuterRef('author')
+            ).values('pk')[:limit]
+        ))
+
+    def refresh_counters(self):
+        return self.update(
+            favorites_count=count_links(Recipe.favorite.through),
+            carts_count=count_links(Recipe.cart.through),
+        )
+
+    def feed_keys(self, authors, limit, after=None):
+        recipes = self.order_by('-pub_date', '-id')
+        if after is not None:
+            recipes = recipes.filter(
+                models.Q(pub_date__lt=after[0])
+                | models.Q(pub_date=after[0], pk__lt=after[1])
+            )
+        author_ids = list(authors.values_list(
+            'id', flat=True
+        )[:settings.FEED_MERGE_MAX_AUTHORS + 1])
+        if len(author_ids) > settings.FEED_MERGE_MAX_AUTHORS:
+            return list(recipes.filter(
+                author__in=authors.values('id')
+            ).values_list('pub_date', 'pk')[:limit])
+
+        streams = [
+            recipes.filter(author=author).values_list('pub_date', 'pk')[:limit]
+            for author in author_ids
+        ]
+        if not streams:
+            return []
+        if connections[self.db].features.supports_slicing_ordering_in_compound:
+            return sorted(
+                streams[0].union(*streams[1:], all=True), reverse=True
+            )[:limit]
+        return list(islice(merge(*streams, reverse=True), limit))
+
+    def refresh_search_vectors(self):
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredient_names = models.Subquery(
+            RecipeIngredientLink.objects.filter(
+                recipe=models.OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredients__name', ' ')
+            ).values('names'),
+            output_field=models.TextField()
+        )
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+            + SearchVector(ingredient_names, weight='C', config=SEARCH_CONFIG)
+        ))
+
+    def search(self, term):
+        tokens = SEARCH_TOKEN_RE.findall(term)
+        if not tokens:
+            return self.none()
+        query = SearchQuery(
+            ' & '.join(f'{token}:*' for token in tokens),
+            config=SEARCH_CONFIG, search_type='raw'
+        )
+        return self.annotate(
+            rank=SearchRank(models.F('search_vector'), query)
+        ).filter(search_vector=query).order_by('-rank', '-pub_date', '-id')
+
+
 class Recipe(models.Model):
     name = models.CharField(verbose_name='Название блюда', max_length=200)
     author = models.ForeignKey(
@@ -81,17 +193,68 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
-    image = models.ImageField(verbose_name='Фото блюда', upload_to='images/')
+    image = models.ImageField(
+        verbose_name='Фото блюда',
+        upload_to='images/',
+        storage=ContentAddressedStorage(),
+        db_index=True
+    )
+    renditions_ready = models.BooleanField(
+        verbose_name='Миниатюры готовы',
+        default=False,
+        editable=False
+    )
+    renditions_version = models.CharField(
+        verbose_name='Версия миниатюр',
+        max_length=16,
+        blank=True,
+        editable=False
+    )
     text = models.TextField(verbose_name='Описание блюда')
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         validators=(MinValueValidator(settings.RECIPE_MIN_COOKING_TIME), )
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый индекс',
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', )
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-pub_date'),
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=('-carts_count', '-pub_date'),
+                name='recipe_carts_count_idx'
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('name', 'author'),
@@ -134,3 +297,94 @@ class RecipeIngredientLink(models.Model):
 
     def __str__(self) -> str:
         return f'{self.ingredients} - {self.amount}'
+
+
+class ShoppingCartItemQuerySet(models.QuerySet):
+    def live(self, users=None, ingredients=None):
+        links = RecipeIngredientLink.objects.all()
+        if users is not None:
+            links = links.filter(recipe__cart__in=users)
+        if ingredients is not None:
+            links = links.filter(ingredients__in=ingredients)
+        return links.values(
+            'ingredients', user=models.F('recipe__cart')
+        ).annotate(
+            total=models.Sum('amount')
+        ).filter(user__isnull=False).order_by()
+
+    def lock_users(self, users=None):
+        locked = User.objects.order_by('pk').select_for_update()
+        if users is None:
+            locked = locked.filter(
+                models.Q(pk__in=self.values('user'))
+                | models.Q(pk__in=Recipe.cart.through.objects.values('user'))
+            )
+        else:
+            locked = locked.filter(pk__in=users)
+        return list(locked.values_list('pk', flat=True))
+
+    @transaction.atomic
+    def refresh(self, users=None, ingredients=None):
+        locked = self.lock_users(users)
+        stale = self.all()
+        if users is not None:
+            stale = stale.filter(user__in=users)
+        if ingredients is not None:
+            stale = stale.filter(ingredient__in=ingredients)
+        stale.delete()
+        modified = timezone.now()
+        items = self.bulk_create(
+            self.model(
+                user_id=row['user'],
+                ingredient_id=row['ingredients'],
+                amount=row['total'],
+                modified=modified
+            )
+            for row in self.live(users, ingredients)
+        )
+        self.touch(locked, modified)
+        return items
+
+    def touch(self, users, modified=None):
+        # Время изменения общее для всего списка: удалённая позиция
+        # не должна откатывать Last-Modified назад.
+        return self.filter(user__in=users).update(
+            modified=modified or timezone.now()
+        )
+
+
+class ShoppingCartItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_items',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        related_name='shopping_cart_items',
+        on_delete=models.CASCADE
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+    modified = models.DateTimeField(
+        verbose_name='Изменено',
+        default=timezone.now,
+        editable=False
+    )
+
+    objects = ShoppingCartItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Список покупок'
+        ordering = ('user', )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_user_ingredient'
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.ingredient} - {self.amount}'
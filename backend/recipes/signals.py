@@ -0,0 +1,131 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import Signal, receiver
+
+from recipes.images import release_image, schedule_renditions
+from recipes.models import (Ingredient, Recipe, RecipeIngredientLink,
+                            ShoppingCartItem)
+
+User = get_user_model()
+ingredients_imported = Signal()
+recipes_imported = Signal()
+counters_refreshed = Signal()
+
+
+@receiver(m2m_changed, sender=Recipe.cart.through)
+def refresh_shopping_cart(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cart_users = list(instance.cart.values_list('id',
+                                                              flat=True))
+    elif action == 'post_clear':
+        users = [instance.pk] if reverse else instance._cart_users
+        ShoppingCartItem.objects.refresh(users=users)
+    elif action in ('post_add', 'post_remove'):
+        users, recipes = ([instance.pk], pk_set) if reverse else (
+            pk_set, [instance.pk]
+        )
+        ShoppingCartItem.objects.refresh(
+            users=users,
+            ingredients=RecipeIngredientLink.objects.filter(
+                recipe__in=recipes
+            ).values('ingredients')
+        )
+
+
+def update_counter(field, related_name, instance, action, reverse,
+                   pk_set):
+    if action == 'pre_clear':
+        instance._cleared_recipes = [instance.pk] if not reverse else list(
+            getattr(instance, related_name).values_list('id', flat=True)
+        )
+    elif action == 'post_add':
+        recipes = pk_set if reverse else (instance.pk,)
+        Recipe.objects.filter(pk__in=recipes).update(
+            **{field: F(field) + (1 if reverse else len(pk_set))}
+        )
+    elif action in ('post_remove', 'post_clear'):
+        recipes = instance._cleared_recipes if action == 'post_clear' else (
+            pk_set if reverse else (instance.pk,)
+        )
+        Recipe.objects.filter(pk__in=recipes).refresh_counters()
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+def update_favorites_count(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    update_counter('favorites_count', 'favorites', instance, action,
+                   reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.cart.through)
+def update_carts_count(sender, instance, action, reverse, pk_set,
+                       **kwargs):
+    update_counter('carts_count', 'carts', instance, action, reverse,
+                   pk_set)
+
+
+@receiver(pre_delete, sender=User)
+def remember_counted_recipes(sender, instance, **kwargs):
+    instance._counted_recipes = set(
+        instance.favorites.values_list('id', flat=True)
+    ) | set(instance.carts.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def refresh_counted_recipes(sender, instance, **kwargs):
+    if instance._counted_recipes:
+        Recipe.objects.filter(
+            pk__in=instance._counted_recipes
+        ).refresh_counters()
+        counters_refreshed.send(
+            sender=Recipe, recipe_ids=instance._counted_recipes
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_shopping_carts(sender, instance, **kwargs):
+    instance._cart_users = list(instance.cart.values_list('id', flat=True))
+    instance._cart_ingredients = list(
+        instance.ingredient.values_list('ingredients', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_shopping_carts(sender, instance, **kwargs):
+    if instance._cart_users:
+        ShoppingCartItem.objects.refresh(
+            users=instance._cart_users,
+            ingredients=instance._cart_ingredients
+        )
+    release_image(instance.image.name)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_carts(sender, instance, **kwargs):
+    instance._cart_users = list(
+        instance.shopping_cart_items.values_list('user', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def touch_ingredient_carts(sender, instance, **kwargs):
+    if instance._cart_users:
+        ShoppingCartItem.objects.touch(instance._cart_users)
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_image(sender, instance, **kwargs):
+    instance._old_image = Recipe.objects.filter(
+        pk=instance.pk
+    ).values_list('image', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Recipe)
+def make_image_renditions(sender, instance, **kwargs):
+    if instance.image and not instance.renditions_ready:
+        schedule_renditions(instance)
+    if instance._old_image != instance.image.name:
+        release_image(instance._old_image)
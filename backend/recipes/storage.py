@@ -0,0 +1,57 @@
+import os
+import posixpath
+from hashlib import sha256
+from uuid import uuid4
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = sha256()
+        chunks = []
+        for chunk in content.chunks():
+            digest.update(chunk)
+            chunks.append(chunk)
+        digest = digest.hexdigest()
+        name = posixpath.join(
+            posixpath.dirname(name), digest[:2],
+            digest[2:] + posixpath.splitext(name)[1].lower()
+        )
+        data = b''.join(chunks)
+        self.restore(name, data)
+        # Файл с тем же содержимым мог быть удалён как неиспользуемый,
+        # пока транзакция с новой ссылкой на него ещё не завершилась.
+        transaction.on_commit(lambda: self.restore(name, data))
+        return name
+
+    def restore(self, name, data):
+        if self.exists(name):
+            return
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{uuid4().hex}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        if self.file_permissions_mode is not None:
+            os.chmod(temporary, self.file_permissions_mode)
+        os.replace(temporary, path)
+
+    def discard(self, name, is_used):
+        path = self.path(name)
+        discarded = f'{path}.{uuid4().hex}.discarded'
+        try:
+            os.replace(path, discarded)
+        except FileNotFoundError:
+            return True
+        if is_used():
+            os.replace(discarded, path)
+            return False
+        os.remove(discarded)
+        return True
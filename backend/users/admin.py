@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.admin import register
 
-from recipes.models import Recipe
+from recipes.models import Recipe, ShoppingCartItem
 from users.models import User
 
 
@@ -24,3 +24,14 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ('username', 'email')
     empty_value_display = '-пусто-'
     inlines = (RecipeInlineCart, RecipeInlineFavorite)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        recipes = set()
+        for formset in formsets:
+            for inline in formset.forms:
+                if inline.has_changed():
+                    recipes.update((inline.initial.get('recipe'),
+                                    inline.instance.recipe_id))
+        Recipe.objects.filter(pk__in=recipes).refresh_counters()
+        ShoppingCartItem.objects.refresh(users=(form.instance.pk,))